@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# filename: crawler.py
+#
+# 多线程抓取，供 update_db 中的 WxSpider 使用
+#
+# 所有线程共用一个 requests.Session ，复用 keep-alive 连接；
+# 请求按 rate 限速，失败时指数退避重试；
+# 结果逐条追加到检查点文件，中断后重新运行会跳过已完成的条目
+#
+
+import os
+import time
+import json
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+	from .utilfuncs import show_status
+	from .utilclass import Logger
+except (ImportError, SystemError, ValueError):
+	from utilfuncs import show_status
+	from utilclass import Logger
+
+
+logger = Logger("crawler")
+
+
+__all__ = ["Crawler", "Checkpoint"]
+
+
+class RateLimiter(object):
+	""" 相邻两次请求至少间隔 1/rate 秒，rate 为 None 时不限速 """
+
+	def __init__(self, rate=None):
+		self.interval = 1.0 / rate if rate else 0
+		self.lock = threading.Lock()
+		self.nextTime = 0
+
+	def wait(self):
+		with self.lock:
+			now = time.monotonic()
+			delay = self.nextTime - now
+			self.nextTime = max(now, self.nextTime) + self.interval # 先占位，再在锁外等待
+		if delay > 0:
+			time.sleep(delay)
+
+
+class Checkpoint(object):
+	""" 每行一个 {"key": ..., "result": ...} 的 json 文件，结果须可 json 序列化 """
+
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.Lock()
+
+	def load(self):
+		results = {}
+		if not os.path.exists(self.path):
+			return results
+		with open(self.path, "r", encoding="utf-8") as fp:
+			for line in fp:
+				try:
+					record = json.loads(line)
+				except ValueError: # 中断时写了一半的最后一行
+					continue
+				results[record["key"]] = record["result"]
+		return results
+
+	def save(self, key, result):
+		with self.lock, open(self.path, "a", encoding="utf-8") as fp:
+			fp.write(json.dumps({"key": key, "result": result}, ensure_ascii=False) + "\n")
+
+	def remove(self):
+		if os.path.exists(self.path):
+			os.remove(self.path)
+
+
+class Crawler(object):
+	""" 共用 Session 的线程池抓取
+
+		crawler = Crawler(headers, workers=8, rate=5)
+		results = crawler.map(func, items, key=lambda item: item["newsID"], checkpoint=Checkpoint(path))
+	"""
+
+	Retry_Status = {429, 500, 502, 503, 504} # 其余的 4xx 直接报错
+
+	def __init__(self, headers=None, workers=8, rate=None, retries=3, backoff=1.0, timeout=15):
+		self.workers = workers
+		self.retries = retries
+		self.backoff = backoff
+		self.timeout = timeout
+		self.limiter = RateLimiter(rate)
+		self.session = requests.Session()
+		adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers) # 每个线程一个连接
+		self.session.mount("http://", adapter)
+		self.session.mount("https://", adapter)
+		if headers is not None:
+			self.session.headers.update(headers)
+
+	def close(self):
+		self.session.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, trace):
+		self.close()
+
+	def get(self, url, params=None):
+		""" 带重试的 GET ，第 n 次重试前等待 backoff * 2^(n-1) 秒左右 """
+		for attempt in range(self.retries + 1):
+			self.limiter.wait()
+			try:
+				resp = self.session.get(url, params=params, timeout=self.timeout)
+				if resp.status_code in self.Retry_Status:
+					raise requests.HTTPError("%s for %s" % (resp.status_code, url), response=resp)
+				resp.raise_for_status()
+				return resp
+			except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as err:
+				retryable = not isinstance(err, requests.HTTPError) or err.response.status_code in self.Retry_Status
+				if not retryable or attempt == self.retries:
+					raise err
+				delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+				logger.warning("%s, retry in %.1fs" % (repr(err), delay))
+				time.sleep(delay)
+
+	def map(self, func, items, key=None, checkpoint=None, desc="crawling ..."):
+		""" 在线程池中对每个 item 调用 func ，按 items 的顺序返回结果
+
+			给出 checkpoint 时，key(item) 为条目在检查点中的键，已完成的条目直接取检查点中的结果
+			任何一个条目出错都会取消尚未开始的条目并抛出异常，已完成的条目保留在检查点中
+		"""
+		items = list(items)
+		keys = [key(item) for item in items] if key is not None else list(range(len(items)))
+		results = checkpoint.load() if checkpoint is not None else {}
+		todo = [(k, item) for k, item in zip(keys, items) if k not in results]
+		if checkpoint is not None and len(todo) < len(items):
+			logger.info("resume from checkpoint, %s/%s done" % (len(items) - len(todo), len(items)))
+
+		with ThreadPoolExecutor(self.workers) as executor:
+			futures = {executor.submit(func, item): k for k, item in todo}
+			try:
+				for future in show_status(as_completed(futures), desc):
+					k = futures[future]
+					results[k] = future.result()
+					if checkpoint is not None:
+						checkpoint.save(k, results[k])
+			except BaseException as err:
+				for future in futures:
+					future.cancel()
+				raise err
+		return [results[k] for k in keys]
@@ -15,8 +15,10 @@ import matplotlib.pyplot as plt
 
 try:
 	from .utilfuncs import write_csv, read_csv, show_status, pkl_load, pkl_dump, isChinese #从别的包调用
+	from .segmentation import cut_corpus
 except (SystemError, ImportError): #如果失败，则说明直接调用
 	from utilfuncs import write_csv, read_csv, show_status, pkl_load, pkl_dump, isChinese
+	from segmentation import cut_corpus
 
 basedir = os.path.abspath(os.path.join(os.path.dirname(__file__),"..")) # 根目录为app
 cachedir = os.path.join(basedir,"cache")
@@ -51,6 +53,9 @@ class DataBase(object):
 		results = self.dbCursor.fetchall()
 		return [line[0] for line in results], [line[1] for line in results]
 
+def is_word(stopWords, frag):
+	return (frag not in stopWords) and (not frag.isspace() and (not frag.isdigit()))
+
 class analyzer(object):
 
 	def __init__(self):
@@ -68,18 +73,11 @@ class analyzer(object):
 		if fromCache:
 			wordFrags = pkl_load("wordFrags.pkl")
 		else:
-			wordFragsList = list()
 			with DataBase() as db:
 				newsID, newsData = db.get_news()
-			jieba.enable_parallel(4)
-			for news in show_status(newsData,"cut words"):
-				frags = jieba.cut(news, cut_all=False)
-				words = [frag for frag in frags if (frag not in self.stopWords) \
-							and (not frag.isspace() and (not frag.isdigit()))]
-				wordFragsList.append(words)
-			jieba.disable_parallel()
+			wordFragsList = show_status(cut_corpus(newsData, partial(is_word, self.stopWords)), "cut words")
 			wordFrags = dict(zip(newsID, wordFragsList))
-			pkl_dump("wordFrags.pkl")
+			pkl_dump("wordFrags.pkl", wordFrags)
 		return wordFrags
 
 	def get_total_freq(self):
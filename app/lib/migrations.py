@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# filename: migrations.py
+#
+# pkuyouth.db 的版本化迁移，版本号记录在 PRAGMA user_version 中
+#
+# 每一步都可以重复执行，update_db 重建表之后以 force=True 重新应用全部迁移
+#
+
+import sqlite3
+
+try:
+	from .utilclass import Logger, SQLiteDB
+except (ImportError, SystemError, ValueError):
+	from utilclass import Logger, SQLiteDB
+
+
+logger = Logger("migrations")
+
+
+__all__ = ["migrate", "check_plans"]
+
+
+def add_date_column(con):
+	""" newsInfo.date = date(masssend_time) ，由触发器维护，供按日期排序、检索时走索引 """
+	cols = [row[1] for row in con.execute("PRAGMA table_info(newsInfo)")]
+	if "date" not in cols:
+		con.execute("ALTER TABLE newsInfo ADD COLUMN date CHAR(10)")
+	con.execute("UPDATE newsInfo SET date = date(masssend_time) WHERE date IS NOT date(masssend_time)")
+	con.execute("""CREATE TRIGGER IF NOT EXISTS newsInfo_date_insert AFTER INSERT ON newsInfo
+		BEGIN
+			UPDATE newsInfo SET date = date(NEW.masssend_time) WHERE newsID == NEW.newsID;
+		END
+	""") # INSERT OR REPLACE 也会触发
+	con.execute("""CREATE TRIGGER IF NOT EXISTS newsInfo_date_update AFTER UPDATE OF masssend_time ON newsInfo
+		BEGIN
+			UPDATE newsInfo SET date = date(NEW.masssend_time) WHERE newsID == NEW.newsID;
+		END
+	""")
+
+def add_content_log(con):
+	""" newsContent 每写入一行，在 newsContentLog 中追加一条记录，seq 为 AUTOINCREMENT ，删除后也不会复用
+
+		whoosh 索引以已写入的最大 seq 为 watermark 增量更新，不能用 newsContent 的 rowid ，
+		因为删除最新的一行后 SQLite 会把同一个 rowid 分配给下一次插入
+	"""
+	con.execute("CREATE TABLE IF NOT EXISTS newsContentLog (seq INTEGER PRIMARY KEY AUTOINCREMENT, newsID CHAR(11) NOT NULL)")
+	if not has_table(con, "newsContent"): # 表重建后以 force=True 重新应用
+		return
+	con.execute("""CREATE TRIGGER IF NOT EXISTS newsContent_log_insert AFTER INSERT ON newsContent
+		BEGIN
+			INSERT INTO newsContentLog (newsID) VALUES (NEW.newsID);
+		END
+	""") # INSERT OR REPLACE 也会触发
+	con.execute("""CREATE TRIGGER IF NOT EXISTS newsContent_log_update AFTER UPDATE ON newsContent
+		BEGIN
+			INSERT INTO newsContentLog (newsID) VALUES (NEW.newsID);
+		END
+	""")
+
+def recreate_index(name, definition):
+	""" 索引定义有变化时删除重建，定义相同则跳过 """
+	def step(con):
+		sql = "CREATE INDEX %s ON %s" % (name, definition)
+		old = con.execute("SELECT sql FROM sqlite_master WHERE type == 'index' AND name == ?", (name,)).fetchone()
+		if old is not None and old[0] == sql:
+			return
+		con.execute("DROP INDEX IF EXISTS %s" % name)
+		con.execute(sql)
+	return step
+
+
+Migrations = [ # (版本号, 说明, 若干 SQL 语句或以连接为参数的函数)
+	(1, "secondary indexes", [
+		"CREATE INDEX IF NOT EXISTS newsDetail_column ON newsDetail (column, in_use, newsID)",
+		"CREATE INDEX IF NOT EXISTS newsDetail_in_use ON newsDetail (in_use, newsID)",
+		"CREATE INDEX IF NOT EXISTS newsDetail_reporter ON newsDetail (reporter, newsID)",
+	]),
+	(2, "derived date column", [
+		add_date_column,
+		"CREATE INDEX IF NOT EXISTS newsInfo_date ON newsInfo (date DESC, idx, newsID)",
+		"CREATE INDEX IF NOT EXISTS newsInfo_read_num_date ON newsInfo (read_num DESC, date DESC, idx, newsID)",
+	]),
+	(3, "generation counter", [
+		"CREATE TABLE IF NOT EXISTS dbMeta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+		"INSERT OR IGNORE INTO dbMeta (key, value) VALUES ('generation', 0)",
+	]),
+	(4, "newsContent write log", [
+		add_content_log,
+	]),
+	(5, "keyset order indexes", [ # 排序键含 i.newsID ，索引须包含它才不用临时 B 树排序
+		"DROP INDEX IF EXISTS newsInfo_masssend_time", # 已改按 date 排序，不再使用
+		"DROP INDEX IF EXISTS newsInfo_read_num",
+		recreate_index("newsInfo_date", "newsInfo (date DESC, idx, newsID)"),
+		recreate_index("newsInfo_read_num_date", "newsInfo (read_num DESC, date DESC, idx, newsID)"),
+	]),
+]
+
+Version = Migrations[-1][0]
+
+
+def has_table(con, table):
+	return con.execute("SELECT count(*) FROM sqlite_master WHERE type == 'table' AND name == ?", (table,)).fetchone()[0] > 0
+
+def migrate(dbLink, force=False):
+	""" 依次应用尚未应用的迁移，每一步在一个事务中完成；force 则全部重新应用 """
+	con = sqlite3.connect(dbLink, isolation_level=None) # 手动控制事务
+	try:
+		if not all(has_table(con, table) for table in ("newsInfo","newsDetail")): # 表尚未建立
+			return 0
+		version = con.execute("PRAGMA user_version").fetchone()[0]
+		for _version, desc, steps in Migrations:
+			if _version <= version and not force:
+				continue
+			con.execute("BEGIN IMMEDIATE")
+			try:
+				for step in steps:
+					if callable(step):
+						step(con)
+					else:
+						con.execute(step)
+				con.execute("PRAGMA user_version = %d" % max(_version, version))
+			except Exception as err:
+				con.execute("ROLLBACK")
+				raise err
+			else:
+				con.execute("COMMIT")
+				logger.info("migration %d (%s) applied" % (_version, desc))
+		return max(version, Version)
+	finally:
+		con.close()
+
+
+def checked_queries():
+	""" 需要走索引的查询，用 SQLiteDB.news_sql 生成与 minipgm_api/db.py 实际执行的相同的 SQL ，
+		包括 i.newsID 排序键和 keyset 翻页条件。返回 {名称: (sql, params)}
+	"""
+	Time_After = ["2018-01-01", "1", "00000000000"] # 上一页最后一行的排序键
+	Read_After = [1000] + Time_After
+	return {
+		"hot news": SQLiteDB.news_sql(orderBy=SQLiteDB.Order_By_Read, limit=10),
+		"hot news next page": SQLiteDB.news_sql(orderBy=SQLiteDB.Order_By_Read, limit=10, after=Read_After),
+		"latest news": SQLiteDB.news_sql(limit=10),
+		"column news": SQLiteDB.news_sql(["d.column == ?"], [""], orderBy=SQLiteDB.Order_By_Time, limit=10),
+		"column news next page": SQLiteDB.news_sql(["d.column == ?"], [""], orderBy=SQLiteDB.Order_By_Time, limit=10, after=Time_After),
+		"reporter news": SQLiteDB.news_sql(["i.newsID IN (?,?,?)"], ["", "", ""], orderBy=SQLiteDB.Order_By_Time, limit=10),
+		"search by date": SQLiteDB.news_sql(["i.date == ?"], [""], filter_in_use=False),
+		"search by month": SQLiteDB.news_sql(["i.date BETWEEN ? AND ?"], ["", ""], filter_in_use=False),
+		"column newsIDs": ("SELECT newsID FROM newsDetail WHERE column == ?", [""]),
+		"discard newsIDs": ("SELECT newsID FROM newsDetail WHERE in_use == 0", []),
+		"date range start": ("SELECT min(date) FROM newsInfo", []),
+		"date range end": ("SELECT max(date) FROM newsInfo", []),
+	}
+
+Sorted_Queries = {"reporter news"} # 按主键取出 IN 列表中的文章后排序，行数不超过列表长度，比沿日期索引扫描全表快
+
+def check_plans(dbLink):
+	""" 打印各个查询的 EXPLAIN QUERY PLAN ，返回仍在全表扫描或需要临时 B 树排序的查询 """
+	con = sqlite3.connect(dbLink)
+	try:
+		failures = []
+		for name, (sql, params) in checked_queries().items():
+			plan = [row[-1] for row in con.execute("EXPLAIN QUERY PLAN " + sql, params)]
+			scans = [detail for detail in plan if detail.startswith("SCAN") and "INDEX" not in detail]
+			sorts = [detail for detail in plan if "TEMP B-TREE" in detail and name not in Sorted_Queries] # 包括 RIGHT PART OF ORDER BY
+			if scans or sorts:
+				failures.append(name)
+			logger.info("%s: %s" % (name, " | ".join(plan)))
+		if failures:
+			logger.warning("full table scan or temp b-tree in: %s" % ", ".join(failures))
+		return failures
+	finally:
+		con.close()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# filename: minhash.py
+#
+# MinHash 签名 + LSH 分桶，用于快速找出关键词集合 Tanimoto 系数较高的候选文章
+#
+# 两个集合的 MinHash 值相等的概率恰为其 Tanimoto 系数 s ，
+# 签名分为 bands 段，每段 rows 个值，某一段完全相同即成为候选，
+# 候选概率为 1 - (1 - s^rows)^bands
+#
+
+import numpy as np
+
+
+__all__ = ["hash_params", "signature", "signatures", "band_keys", "lsh_build", "lsh_query"]
+
+
+Prime = np.uint64(2**31 - 1) # 哈希函数 (a*x + b) mod Prime ，x 为关键词所在的列
+Empty = 2**31 - 1 # 空集合的签名，大于任何哈希值
+
+Mix = np.uint64(0x100000001b3) # FNV 乘数，把一段签名混合成一个 uint64
+
+
+def hash_params(perms, seed=0):
+	""" 生成 perms 组哈希函数的参数 a, b ，同一 seed 下结果不变 """
+	rng = np.random.RandomState(seed)
+	a = rng.randint(1, 2**31 - 1, size=perms).astype(np.uint64)
+	b = rng.randint(0, 2**31 - 1, size=perms).astype(np.uint64)
+	return a, b
+
+def signature(indices, a, b):
+	""" 单个集合的 MinHash 签名，返回 (1, perms) 的 uint32 数组 """
+	indices = np.asarray(indices, dtype=np.uint64)
+	if len(indices) == 0:
+		return np.full((1, len(a)), Empty, dtype=np.uint32)
+	hashes = (a[:,None] * indices[None,:] + b[:,None]) % Prime
+	return hashes.min(axis=1).astype(np.uint32)[None,:]
+
+def signatures(indptr, indices, a, b):
+	""" 按 CSR 格式的集合计算 MinHash 签名，返回 (集合数, perms) 的 uint32 数组 """
+	indptr = np.asarray(indptr)
+	indices = np.asarray(indices, dtype=np.uint64)
+	count = len(indptr) - 1
+	sigs = np.full((count, len(a)), Empty, dtype=np.uint32)
+	nonEmpty = np.flatnonzero(np.diff(indptr) > 0)
+	if len(nonEmpty) == 0:
+		return sigs
+	for perm in range(len(a)):
+		hashes = (a[perm] * indices + b[perm]) % Prime
+		sigs[nonEmpty, perm] = np.minimum.reduceat(hashes, indptr[nonEmpty]) # 空集合的起点会与下一个重合，故跳过
+	return sigs
+
+def band_keys(sigs, bands):
+	""" 把签名按段混合成 (集合数, bands) 的 uint64 分桶键，不同段的键互不相同 """
+	count, perms = sigs.shape
+	rows = perms // bands
+	sigs = sigs[:, :bands*rows].reshape(count, bands, rows).astype(np.uint64)
+	keys = np.broadcast_to(np.arange(bands, dtype=np.uint64), (count, bands)).copy() # 以段号为初值
+	with np.errstate(over="ignore"):
+		for row in range(rows):
+			keys = (keys * Mix) ^ sigs[:, :, row]
+	return keys
+
+def lsh_build(keys):
+	""" 把所有分桶键排序，返回 (有序的键, 对应的集合序号) ，均为一维数组 """
+	flat = keys.ravel()
+	order = np.argsort(flat, kind="stable")
+	return flat[order], (order // keys.shape[1]).astype(np.int32)
+
+def lsh_query(sortedKeys, owners, keys):
+	""" 返回与 keys 至少有一段相同的集合序号，已去重 """
+	lo = np.searchsorted(sortedKeys, keys, side="left")
+	hi = np.searchsorted(sortedKeys, keys, side="right")
+	lens = hi - lo
+	total = lens.sum()
+	if total == 0:
+		return np.array([], dtype=np.int32)
+	offsets = np.repeat(lo - np.cumsum(lens) + lens, lens) # 把各个区间拼成一个下标数组
+	return np.unique(owners[offsets + np.arange(total)])
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# filename: minipgm_api/cache.py
+#
+# NewsDB 只读方法的结果缓存，数据只在 update_db 和后台修改时变化，其余时间相同的查询直接从内存返回
+#
+
+import time
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+try:
+	from ..utilclass import Logger, SQLiteDB
+except (ImportError, SystemError, ValueError):
+	from utilclass import Logger, SQLiteDB
+
+
+logger = Logger(__name__)
+
+
+__all__ = [
+	"ResultCache",
+]
+
+
+def freeze(value):
+	""" 把参数化为可哈希的键 """
+	if isinstance(value, dict):
+		return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+	elif isinstance(value, (list,tuple)):
+		return tuple(freeze(v) for v in value)
+	elif isinstance(value, (set,frozenset)):
+		return frozenset(value)
+	return value
+
+def copy_result(result):
+	""" 调用者会修改返回的文章信息（如添加 star 字段），因此每次返回一份浅拷贝 """
+	if isinstance(result, list):
+		return [dict(item) if isinstance(item, dict) else item for item in result]
+	elif isinstance(result, dict):
+		return dict(result)
+	return result
+
+
+class ResultCache(object):
+	""" 以 (方法名, 参数) 为键的 LRU 缓存
+
+		缓存的有效性由数据库 dbMeta 表中的 generation 决定，update_db 和 miniprogram_manage.change
+		写入数据后将其加一，各个 worker 最多 Check_Interval 秒后发现变化并清空缓存
+	"""
+
+	Check_Interval = 1.0 # 两次读取 generation 的最短间隔（秒）
+
+	def __init__(self, size=256, onExpire=None):
+		self.size = size
+		self.onExpire = onExpire # generation 变化时调用，如令文章目录立即重新检查
+		self.lock = threading.Lock()
+		self.results = OrderedDict()
+		self.generation = None
+		self.checkTime = 0
+
+	def check(self):
+		now = time.time()
+		if now - self.checkTime < self.Check_Interval:
+			return
+		with SQLiteDB(readonly=True) as db:
+			generation = db.get_generation()
+		with self.lock:
+			self.checkTime = now
+			if generation == self.generation:
+				return
+			self.results.clear()
+			self.generation = generation
+		if self.onExpire is not None:
+			self.onExpire()
+		logger.info("result cache cleared, generation %s" % generation)
+
+	def cached(self, method):
+		""" 装饰 NewsDB 的方法 """
+		@wraps(method)
+		def wrapper(db, *args, **kwargs):
+			self.check()
+			key = (method.__name__, freeze(args), freeze(kwargs))
+			with self.lock:
+				generation = self.generation
+				hit = key in self.results
+				if hit:
+					self.results.move_to_end(key)
+					result = self.results[key]
+			if not hit:
+				result = method(db, *args, **kwargs)
+				with self.lock:
+					if generation == self.generation: # 计算期间数据未变化才写入
+						self.results[key] = result
+						while len(self.results) > self.size:
+							self.results.popitem(last=False)
+			return copy_result(result)
+		return wrapper
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# filename: minipgm_api/catalog.py
+#
+# 文章目录的只读快照，供只读接口直接取页，不必每次查询整个文章库
+#
+
+import os
+import time
+import random
+import threading
+
+try:
+	from ..utilclass import Logger, SQLiteDB
+except (ImportError, SystemError, ValueError):
+	from utilclass import Logger, SQLiteDB
+
+
+logger = Logger(__name__)
+
+
+__all__ = [
+	"Catalog",
+	"NewsCatalog",
+]
+
+
+class Catalog(object):
+	""" 按列存储的文章目录，创建后不再修改
+
+		各列均为与 newsIDs 等长的元组，row 为文章在其中的下标
+		byTime / byRead 为预先排好序的行号，与 get_news_by_ID 的默认排序和 get_hot_news 一致
+		游标翻页时用 time_key / read_key 在排好序的行号中二分查找，排序键与 SQLiteDB.Order_By_* 相同
+	"""
+
+	News_Fields = ("title","time","sn","like_num","read_num","in_use","newsID") # 与 get_news_by_ID 返回的字段相同
+
+	def __init__(self, newsList, duplicates=()):
+		self.newsIDs = tuple(news["newsID"] for news in newsList)
+		self.rows = {newsID: row for row, newsID in enumerate(self.newsIDs)}
+		self.columns = {field: tuple(news[field] for news in newsList)
+			for field in self.News_Fields + ("column","digest","cover_url")}
+
+		inUse, dates, readNum = self.columns["in_use"], self.columns["time"], self.columns["read_num"]
+		self.idx = idx = tuple(news["idx"] for news in newsList)
+		allRows = sorted(range(len(newsList)), key=lambda row: (idx[row], self.newsIDs[row])) # time DESC, idx ASC, newsID ASC
+		allRows.sort(key=lambda row: dates[row], reverse=True)
+
+		self.byTimeAll = tuple(allRows) # 包括下架文章，供按日期检索
+		self.byTime = tuple(row for row in allRows if inUse[row])
+		self.byRead = tuple(sorted(self.byTime, key=lambda row: readNum[row], reverse=True)) # read_num DESC, time DESC, idx ASC
+
+		duplicates = frozenset(self.rows[newsID] for newsID in duplicates if newsID in self.rows)
+		self.available = tuple(row for row in self.byTime if row not in duplicates) # 可被随机抽取的文章
+
+		self.byColumn, self.byColumnAll, self.byDate, self.byMonth = {}, {}, {}, {}
+		for row in self.byTime:
+			self.byColumn.setdefault(self.columns["column"][row], []).append(row)
+		for row in self.byTimeAll:
+			self.byColumnAll.setdefault(self.columns["column"][row], []).append(row) # 包括下架文章，与 get_column_newsIDs 的 SQL 一致
+			self.byDate.setdefault(dates[row], []).append(row)
+			self.byMonth.setdefault(dates[row][:7], []).append(row)
+
+	def __len__(self):
+		return len(self.newsIDs)
+
+	def news(self, rows, fields=News_Fields):
+		return [{field: self.columns[field][row] for field in fields} for row in rows]
+
+	@staticmethod
+	def page(rows, limit=None, offset=0):
+		return rows[offset:] if limit is None else rows[offset:offset+limit]
+
+	@staticmethod
+	def time_key(date, idx, newsID): # 化为全部升序的元组，便于比较
+		return (-int(date.replace("-","")), idx, newsID)
+
+	@classmethod
+	def read_key(cls, readNum, date, idx, newsID):
+		return (-readNum,) + cls.time_key(date, idx, newsID)
+
+	def row_time_key(self, row):
+		return self.time_key(self.columns["time"][row], self.idx[row], self.newsIDs[row])
+
+	def row_read_key(self, row):
+		return self.read_key(self.columns["read_num"][row], self.columns["time"][row], self.idx[row], self.newsIDs[row])
+
+	@staticmethod
+	def seek(rows, rowKey, after):
+		""" 第一个排序键大于 after 的位置 """
+		lo, hi = 0, len(rows)
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if rowKey(rows[mid]) <= after:
+				lo = mid + 1
+			else:
+				hi = mid
+		return lo
+
+	def get_random_news(self, count):
+		return self.news(random.sample(self.available, count))
+
+	def get_latest_news(self, count):
+		return self.news(self.byTime[:count], fields=("newsID","title","digest","time","cover_url","sn"))
+
+	def get_hot_news(self, limit=None, offset=0, after=None):
+		if after is not None:
+			offset = self.seek(self.byRead, self.row_read_key, self.read_key(*after))
+		return self.news(self.page(self.byRead, limit, offset))
+
+	def get_column_news(self, column, limit=None, offset=0, after=None):
+		rows = self.byColumn.get(column, [])
+		if after is not None:
+			offset = self.seek(rows, self.row_time_key, self.time_key(*after))
+		return self.news(self.page(rows, limit, offset))
+
+	def get_column_newsIDs(self, column):
+		return [self.newsIDs[row] for row in self.byColumnAll.get(column, [])]
+
+	def get_date_range(self):
+		dates = [date for date in self.byDate if date is not None]
+		return {"start": min(dates, default=None), "end": max(dates, default=None)}
+
+	def search_by_time(self, date, method):
+		if method == "date":
+			return self.news(self.byDate.get(date, []))
+		elif method == "month":
+			return self.news(self.byMonth.get(date[:7], []))
+		return self.news(self.byTimeAll)
+
+
+class NewsCatalog(object):
+	""" 持有当前的 Catalog 快照，数据库文件变化后重新载入，并整体替换
+
+		数据库为 WAL 模式，写入先落在 -wal 文件中，因此同时检查两个文件
+	"""
+
+	Check_Interval = 1.0 # 两次检查文件的最短间隔（秒）
+
+	def __init__(self, dbLink=SQLiteDB.dbLink):
+		self.dbLink = dbLink
+		self.lock = threading.Lock()
+		self.snapshot = None
+		self.signature = None
+		self.checkTime = 0
+
+	def __signature(self):
+		stats = []
+		for path in (self.dbLink, self.dbLink + "-wal"):
+			try:
+				stat = os.stat(path)
+			except FileNotFoundError:
+				stats.append(None)
+			else:
+				stats.append((stat.st_mtime_ns, stat.st_size))
+		return tuple(stats)
+
+	def __load(self):
+		with SQLiteDB(readonly=True) as newsDB:
+			newsList = newsDB.cur.execute("""
+					SELECT  i.newsID,
+							i.title,
+							date(masssend_time) AS time,
+							sn,
+							like_num,
+							read_num,
+							idx,
+							cover AS cover_url,
+							in_use,
+							column,
+							digest
+					FROM newsInfo AS i
+					INNER JOIN newsDetail AS d ON i.newsID == d.newsID
+					LEFT JOIN newsContent AS c ON i.newsID == c.newsID
+				""").fetchall()
+			duplicates = newsDB.get_duplicate_newsIDs()
+		return Catalog(newsList, duplicates)
+
+	def expire(self):
+		""" 下次取快照时立即检查文件，不等待 Check_Interval """
+		self.checkTime = 0
+
+	@property
+	def current(self):
+		now = time.time()
+		if self.snapshot is not None and now - self.checkTime < self.Check_Interval:
+			return self.snapshot
+		with self.lock:
+			self.checkTime = now
+			signature = self.__signature()
+			if self.snapshot is None or signature != self.signature:
+				self.snapshot = self.__load() # 直接替换引用，正在使用旧快照的线程不受影响
+				self.signature = signature
+				logger.info("catalog reloaded, %s news" % len(self.snapshot))
+			return self.snapshot
@@ -10,20 +10,20 @@ cachedir = os.path.join(basedir,"cache")
 
 import random
 
-from whoosh.index import open_dir
-from whoosh.fields import Schema, NUMERIC, TEXT #不可import × 否则与datetime冲突！
-from whoosh.qparser import QueryParser, MultifieldParser
-
 try:
 	# 从外部调用时这样引用
 	from ..utilfuncs import pkl_load, get_MD5
-	from ..utilclass import Logger, MongoDB, SQLiteDB
+	from ..utilclass import Logger, MongoDB, SQLiteDB, WhooshIdx
+	from ..migrations import migrate
 except (ImportError, SystemError, ValueError):
 	sys.path.append("../")
 	from utilfuncs import pkl_load, get_MD5
-	from utilclass import Logger, MongoDB, SQLiteDB
+	from utilclass import Logger, MongoDB, SQLiteDB, WhooshIdx
+	from migrations import migrate
 
 from .error import *
+from .catalog import Catalog, NewsCatalog
+from .cache import ResultCache
 
 
 logger = Logger(__name__)
@@ -36,61 +36,67 @@ __all__ = [
 ]
 
 
-class WhooshIdx(object):
+class NewsIdx(WhooshIdx):
 
-	def __init__(self):
-		self.indexname = "news_index_whoosh"
-		self.idxDir = os.path.join(basedir,"database",self.indexname)
-		self.ix = open_dir(self.idxDir, indexname=self.indexname)
-		self.rels = self.__get_rels()
-		self.discard_docnums = self.__get_discard_docnums()
-
-	def __get_rels(self): # newsID 与 docnum 的关系
-		with self.ix.searcher() as searcher:
-			docnums = searcher.document_numbers()
-			newsIDs = (hit['newsID'] for hit in searcher.documents())
-			rels = dict(zip(newsIDs, docnums))
-		return rels
-
-	def __get_discard_docnums(self):
-		with SQLiteDB() as newsDB:
-			discard_newsIDs = newsDB.get_discard_newsIDs()
-		return self.get_docnums(discard_newsIDs)
-
-	def get_docnums(self, newsIDs):
-		return {self.rels[newsID] for newsID in newsIDs}
-
-	def search_strings(self, querystring, fields, limit, newsIDs=[]):  # 如果没有制定newsIDs，则无filters
-		parser = MultifieldParser(fields, schema=self.ix.schema)
-		query = parser.parse(querystring)
-		with self.ix.searcher() as searcher:
-			hits = searcher.search(
-					q = query,
-					limit = limit,
-					filter = self.get_docnums(newsIDs),
-					mask = self.discard_docnums,
-				)
-			newsIDs = [(hit["newsID"],hit.rank) for hit in hits]
-		return newsIDs
-
-
-newsIdx = WhooshIdx()
+	def get_discard_newsIDs(self):
+		with SQLiteDB(readonly=True) as newsDB:
+			return newsDB.get_discard_newsIDs() + newsDB.get_duplicate_newsIDs() # 重复文也不出现在搜索结果中
+
+	def get_ranges(self):
+		""" 各个栏目、作者的文章，作为 search_by_keyword 的检索范围 """
+		ranges = {}
+		with SQLiteDB(readonly=True) as newsDB:
+			for news in newsDB.select("newsDetail", ("newsID","column")):
+				ranges.setdefault(("column", news["column"]), []).append(news["newsID"])
+		with ReporterDB() as rptDB:
+			for rpt in rptDB.get_rpts(keys=("name","news")):
+				ranges[("reporter", rpt["name"])] = [news["newsID"] for news in rpt["news"]]
+		return ranges
+
+
+migrate(SQLiteDB.dbLink) # 启动时补上尚未应用的索引和派生列
+newsIdx = NewsIdx()
+newsCatalog = NewsCatalog()
+resultCache = ResultCache(onExpire=newsCatalog.expire) # 数据更新后文章目录也立即重新载入
+
+
+def time_keys(news):
+	""" 按时间排序时一篇文章的游标，newsID 由 appmsgid 与 idx 拼接而成 """
+	return [news["time"], news["newsID"][10:], news["newsID"]]
+
+def read_keys(news):
+	""" 按阅读量排序时一篇文章的游标 """
+	return [news["read_num"]] + time_keys(news)
 
 
 class NewsDB(SQLiteDB):
 
+	Use_Catalog = True # 只读接口直接从内存中的文章目录快照取数据，见 catalog.py
+
+	def __init__(self):
+		super().__init__(readonly=True) # 接口只读，从连接池借用连接
+
+	@property
+	def catalog(self):
+		return newsCatalog.current if self.Use_Catalog else None
 
 	def get_random_news(self, count):
-		discard_newsIDs = frozenset(self.get_discard_newsIDs())
+		catalog = self.catalog
+		if catalog is not None:
+			return catalog.get_random_news(count)
+		discard_newsIDs = frozenset(self.get_discard_newsIDs() + self.get_duplicate_newsIDs())
 		newsIDs = random.sample([newsID for newsID in self.get_newsIDs() if newsID not in discard_newsIDs], count)
 		return self.get_news_by_ID(newsIDs)
 
 	def get_latest_news(self, count):
-		newsInfo = self.get_news_by_ID(self.get_newsIDs())[:count]
+		catalog = self.catalog
+		if catalog is not None:
+			return catalog.get_latest_news(count)
+		newsInfo = self.select_news(limit=count)
 		addition = self.select_join(cols=(
 			("newsInfo", ("newsID","cover AS cover_url",)),
 			("newsContent",("digest",)),
-		)).fetchall()
+		), newsIDs=[news["newsID"] for news in newsInfo]).fetchall()
 
 		additionDict = {news["newsID"]:news for news in addition}
 		for news in newsInfo:
@@ -99,44 +105,94 @@ class NewsDB(SQLiteDB):
 		return [{k:v for k,v in news.items()
 			if k in ("newsID","title","digest","time","cover_url","sn")} for news in newsInfo]
 
-	def get_hot_news(self):
-		return self.get_news_by_ID(self.get_newsIDs(),orderBy='read_num DESC ,time DESC, idx ASC')
-
-	def get_column_news(self, column):
-		newsIDs = self.get_column_newsIDs(column)
-		newsInfo =  self.get_news_by_ID(newsIDs)
-		return newsInfo
-
+	@resultCache.cached
+	def get_hot_news(self, limit=None, offset=0, after=None):
+		""" after 为上一页最后一篇文章的 read_keys ，给出时忽略 offset """
+		catalog = self.catalog
+		if catalog is not None:
+			return catalog.get_hot_news(limit, offset, after)
+		return self.select_news(orderBy=self.Order_By_Read, limit=limit, offset=offset, after=after)
+
+	@resultCache.cached
+	def get_column_news(self, column, limit=None, offset=0, after=None):
+		""" after 为上一页最后一篇文章的 time_keys ，给出时忽略 offset """
+		catalog = self.catalog
+		if catalog is not None:
+			return catalog.get_column_news(column, limit, offset, after)
+		return self.select_news(["d.column == ?"], [column], orderBy=self.Order_By_Time, limit=limit, offset=offset, after=after)
+
+	@resultCache.cached
 	def get_column_newsIDs(self, column):
-		return [news["newsID"] for news in self.select("newsDetail",("newsID","column")).fetchall()	if news["column"] == column]
+		catalog = self.catalog
+		if catalog is not None:
+			return catalog.get_column_newsIDs(column)
+		return self.single_cur.execute("SELECT newsID FROM newsDetail WHERE column == ?", (column,)).fetchall()
 
+	@resultCache.cached
 	def get_date_range(self):
+		catalog = self.catalog
+		if catalog is not None:
+			return catalog.get_date_range()
 		return {
-			"start": self.single_cur.execute("SELECT min(date(masssend_time)) FROM newsInfo").fetchone(),
-			"end": self.single_cur.execute("SELECT max(date(masssend_time)) FROM newsInfo").fetchone(),
+			"start": self.single_cur.execute("SELECT min(date) FROM newsInfo").fetchone(),
+			"end": self.single_cur.execute("SELECT max(date) FROM newsInfo").fetchone(),
 		}
 
+	@resultCache.cached
 	def search_by_time(self, date, method):
-		newsInfo = self.get_news_by_ID(self.get_newsIDs(), filter_in_use=False) # 不过滤文章
+		catalog = self.catalog
+		if catalog is not None:
+			return catalog.search_by_time(date, method)
 		if method == "date":
-			newsInfo = [news for news in newsInfo if news["time"] == date]
+			return self.select_news(["i.date == ?"], [date], filter_in_use=False) # 不过滤文章
 		elif method == "month":
-			newsInfo = [news for news in newsInfo if news["time"][:7] == date[:7]]
+			return self.select_news(["i.date BETWEEN ? AND ?"], [date[:7] + "-01", date[:7] + "-31"], filter_in_use=False)
+		return self.select_news(filter_in_use=False)
+
+	@resultCache.cached
+	def group_count(self, table, key):
+		return super().group_count(table, key)
+
+	def get_reporter_news(self, newsIDs, limit=None, offset=0, after=None):
+		return self.get_news_by_ID(newsIDs, orderBy=self.Order_By_Time, limit=limit, offset=offset, after=after)
+
+	def get_favorite_news(self, newsCol, limit=None, offset=0, after=None):
+		""" newsCol 为 {newsID: starTime} ，按收藏时间倒序分页，只取当前页的文章信息
+
+			after 为上一页最后一篇文章的 [starTime, newsID]
+		"""
+		idsSQL, params = self.bulk_ids(newsCol)
+		newsIDs = self.single_cur.execute("SELECT newsID FROM newsDetail WHERE in_use AND newsID IN (%s)" % idsSQL, params).fetchall()
+		sortKey = lambda newsID: (-newsCol[newsID], newsID)
+		newsIDs.sort(key=sortKey)
+		if after is not None:
+			starTime, newsID = after
+			newsIDs = [_newsID for _newsID in newsIDs if sortKey(_newsID) > (-starTime, newsID)]
+		newsIDs = Catalog.page(newsIDs, limit, offset if after is None else 0)
+
+		newsInfo = self.get_news_by_ID(newsIDs)
+		for news in newsInfo:
+			news.update({"starTime": newsCol[news["newsID"]]})
+		newsInfo.sort(key=lambda news: sortKey(news["newsID"]))
 		return newsInfo
 
-	def search_by_keyword(self, keyword, limit, newsIDs=[]):
-		resultsList = newsIdx.search_strings(
-				querystring = " OR ".join(keyword.strip().split()), # 以 OR 连接空格分开的词
+	def has_search_range(self, rangeKey):
+		return newsIdx.has_range(rangeKey)
+
+	def search_by_keyword(self, keyword, limit, newsIDs=[], offset=0, rangeKey=None):
+		""" rangeKey 为 ("column", 栏目) 或 ("reporter", 作者) ，否则以 newsIDs 为检索范围 """
+		resultsList = newsIdx.search_hits(
+				keyword = keyword,
 				fields = ["title","content"],
-				limit = limit,
+				depth = offset + limit,
 				newsIDs = newsIDs,
-			)
-		newsIDs = [hit[0] for hit in resultsList]
-		newsInfo = self.get_news_by_ID(newsIDs, filter_in_use=False) # search时已经 mask
-		newsInfo.sort(key=lambda item: item["newsID"])
-		resultsList.sort(key=lambda hit: hit[0]) #同时按newsID排序两个文章列表，再按rank重新排序
-		for news, hit in zip(newsInfo,resultsList):
-			news.update({"rank": hit[1]}) #添加rank字段用于后续排序
+				conj = "OR", # 以 OR 连接空格分开的词
+				rangeKey = rangeKey,
+			)[offset:]
+		ranks = dict(resultsList)
+		newsInfo = self.get_news_by_ID(list(ranks), filter_in_use=False) # search时已经 mask
+		for news in newsInfo:
+			news.update({"rank": ranks[news["newsID"]]}) #添加rank字段用于后续排序
 		newsInfo.sort(key=lambda news: news["rank"]) #搜索结果按rank排序
 		return newsInfo
 
@@ -31,6 +31,8 @@ __all__ = [
     "int_param",
     "str_param",
     "limited_param",
+    "cursor_param",
+    "next_cursor",
 ]
 
 
@@ -149,6 +151,28 @@ def limited_param(name, param, rational=[]):
         return param
 
 
+def cursor_param(name, param, kind):
+    """ 翻页游标，为空表示第一页，否则返回上一页最后一篇文章的排序键
+
+        游标由 encipher 签名，kind 区分不同接口（及不同的检索条件），不可混用
+    """
+    if param is None or param == '':
+        return None
+    elif not isinstance(param,str):
+        raise TypeError("illegal type of param '%s' -- %s !" % (name, type(param).__name__))
+    _kind, *keys = encipher.untokenize(param) # 签名不对时抛出 BadSignature
+    if _kind != kind:
+        raise ValueError("illegal value of param '%s' !" % name)
+    return keys
+
+
+def next_cursor(kind, newsInfo, limit, keys):
+    """ 下一页的游标，本页不满 limit 篇说明已经到底，返回 None """
+    if len(newsInfo) < limit:
+        return None
+    return encipher.tokenize(kind, *keys(newsInfo[-1]))
+
+
 """
 from io import StringIO
 from functools import wraps
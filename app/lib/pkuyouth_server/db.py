@@ -10,17 +10,14 @@ cachedir = os.path.join(basedir,"cache")
 
 from datetime import datetime
 
-from whoosh.index import open_dir
-from whoosh.qparser import MultifieldParser
-
 try:
 	# from ..utilfuncs import pkl_load
-	from ..utilclass import Logger, SQLiteDB
+	from ..utilclass import Logger, SQLiteDB, WhooshIdx
 except (ImportError, SystemError, ValueError):
 	import sys
 	sys.path.append("../")
 	# from utilfuncs import pkl_load
-	from utilclass import Logger, SQLiteDB
+	from utilclass import Logger, SQLiteDB, WhooshIdx
 
 
 
@@ -30,53 +27,14 @@ logger = Logger('pkuyouth_server_db')
 __all__ = ['NewsDB',]
 
 
-class WhooshIdx(object):
-
-	def __init__(self):
-		self.indexname = "news_index_whoosh"
-		self.idxDir = os.path.join(basedir,"database",self.indexname)
-		self.ix = open_dir(self.idxDir, indexname=self.indexname)
-		self.rels = self.__get_rels()
-		self.discard_docnums = self.__get_discard_docnums()
-
-	def __enter__(self):
-		return self
-
-	def __exit__(self, type, value, trace):
-		self.close()
-
-	def close(self):
-		self.ix.close()
-
-	def __get_rels(self): # newsID 与 docnum 的关系
-		with self.ix.searcher() as searcher:
-			docnums = searcher.document_numbers()
-			newsIDs = (hit['newsID'] for hit in searcher.documents())
-			rels = dict(zip(newsIDs, docnums))
-		return rels
-
-	def __get_discard_docnums(self):
-		with SQLiteDB() as newsDB:
-			discard_newsIDs = newsDB.get_discard_newsIDs()
-		return self.get_docnums(discard_newsIDs)
-
-	def get_docnums(self, newsIDs):
-		return {self.rels[newsID] for newsID in newsIDs}
+class NewsIdx(WhooshIdx):
 
-	def search_strings(self, querystring, fields, limit):
-		parser = MultifieldParser(fields, schema=self.ix.schema)
-		query = parser.parse(querystring)
-		with self.ix.searcher() as searcher:
-			hits = searcher.search(
-					q = query,
-					limit = limit,
-					mask = self.discard_docnums,
-				)
-			newsIDs = [(hit["newsID"],hit.rank) for hit in hits]
-		return newsIDs
+	def get_discard_newsIDs(self):
+		with SQLiteDB(readonly=True) as newsDB:
+			return newsDB.get_discard_newsIDs()
 
 
-newsIdx = WhooshIdx()
+newsIdx = NewsIdx()
 
 
 
@@ -131,10 +89,11 @@ class NewsDB(SQLiteDB):
 			return [news for news in newsInfo if news["time"][2:] == '-'.join((year,month,day))]
 
 	def search_by_keyword(self, keyword, limit):
-		resultsList = newsIdx.search_strings(
-				querystring = " AND ".join(keyword.strip().split()), # 以 AND 连接空格分开的词
+		resultsList = newsIdx.search_hits(
+				keyword = keyword,
 				fields = ["title","content"],
-				limit = limit,
+				depth = limit,
+				conj = "AND", # 以 AND 连接空格分开的词
 			)
 		newsIDs = [hit[0] for hit in resultsList]
 		newsInfo = self.get_news_by_ID(newsIDs, filter_in_use=False) # search时已经 mask
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# filename: segmentation.py
+#
+# 多进程 jieba 分词，用于全量重建时对整个文章库分词
+#
+
+from multiprocessing import Pool, cpu_count
+
+import jieba
+
+
+__all__ = ["cut_corpus"]
+
+
+wordFilter = None # 每个子进程的词过滤函数，由 init_worker 设置
+
+
+def init_worker(_wordFilter):
+	""" 子进程初始化：设置过滤函数，并预先加载 jieba 词典 """
+	global wordFilter
+	wordFilter = _wordFilter
+	jieba.initialize()
+
+def cut_text(text):
+	return [word for word in jieba.cut(text) if wordFilter is None or wordFilter(word)]
+
+def cut_corpus(texts, wordFilter=None, processes=None, chunksize=16):
+	""" 多进程分词，按 texts 的顺序逐篇返回分词结果
+
+		wordFilter 为 word -> bool 的函数，需可 pickle（模块级函数或其 partial）
+		texts 以 chunksize 篇为一组分发给子进程
+	"""
+	processes = processes or cpu_count()
+	jieba.initialize() # 先在主进程加载词典，fork 出的子进程直接继承
+	if processes <= 1:
+		init_worker(wordFilter)
+		yield from map(cut_text, texts)
+	else:
+		with Pool(processes, initializer=init_worker, initargs=(wordFilter,)) as pool:
+			yield from pool.imap(cut_text, texts, chunksize)
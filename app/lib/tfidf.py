@@ -9,6 +9,7 @@ basedir = os.path.join(os.path.dirname(__file__),"../") # app根目录
 cachedir = os.path.join(basedir,"cache")
 
 import math
+import shutil
 from collections import Counter
 from functools import partial
 import sqlite3
@@ -19,13 +20,22 @@ import jieba
 #jieba.initialize()
 
 try:
-	from ..utilfuncs import pkl_dump, pkl_load, isChinese, iter_flat, write_csv, show_status
+	from scipy import sparse
+except ImportError: # 没有 scipy 时不能使用 CosDist
+	sparse = None
+
+try:
+	from ..utilfuncs import pkl_dump, pkl_load, json_dump, json_load, isChinese, iter_flat, write_csv, show_status, MD5
 	from ..utilclass import Logger, SQLiteDB
+	from ..segmentation import cut_corpus
+	from ..minhash import hash_params, signature, signatures, band_keys, lsh_build, lsh_query
 except (ImportError, SystemError, ValueError):
 	import sys
 	sys.path.append('..')
-	from utilfuncs import pkl_dump, pkl_load, isChinese, iter_flat, write_csv, show_status
+	from utilfuncs import pkl_dump, pkl_load, json_dump, json_load, isChinese, iter_flat, write_csv, show_status, MD5
 	from utilclass import Logger, SQLiteDB
+	from segmentation import cut_corpus
+	from minhash import hash_params, signature, signatures, band_keys, lsh_build, lsh_query
 
 
 pkl_load = partial(pkl_load, cachedir)
@@ -37,6 +47,59 @@ logger = Logger("tfidf")
 __all__ = ["TFIDF"]
 
 
+if hasattr(np, "bitwise_count"): # numpy >= 2.0
+	def popcount(words):
+		""" 按行统计 uint64 二维数组中 1 的个数 """
+		return np.bitwise_count(words).sum(axis=1, dtype=np.int32)
+else:
+	Popcount_Table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+	def popcount(words):
+		""" 按行统计 uint64 二维数组中 1 的个数 """
+		return Popcount_Table[np.ascontiguousarray(words).view(np.uint8)].sum(axis=1, dtype=np.int32)
+
+def is_word(stopWords, word):
+	""" 分词结果中需要保留的词 """
+	return isChinese(word) and len(word.strip()) > 1 and word not in stopWords
+
+def packbins(rows, cols, shape):
+	""" 将 (rows, cols) 处为 1 的二值矩阵按行压缩为 uint64 指纹，每个 uint64 存 64 个关键词 """
+	fingerprints = np.zeros((shape[0], (shape[1] + 63) // 64), dtype=np.uint64)
+	np.bitwise_or.at(fingerprints, (rows, cols // 64), np.left_shift(np.uint64(1), (cols % 64).astype(np.uint64)))
+	return fingerprints
+
+def npy_dump(folder, name, array):
+	np.save(os.path.join(folder, "%s.npy" % name), array)
+
+def npy_load(folder, name):
+	""" 以只读 mmap 打开，各个 worker 共享同一份 page cache """
+	return np.load(os.path.join(folder, "%s.npy" % name), mmap_mode="r")
+
+def strings_dump(folder, name, strings):
+	""" 字符串表：所有字符串 utf-8 编码后拼接为一个 uint8 数组，另存每个字符串的起止位置 """
+	blobs = [string.encode("utf-8") for string in strings]
+	offsets = np.zeros(len(blobs)+1, dtype=np.int64)
+	offsets[1:] = np.cumsum([len(blob) for blob in blobs])
+	npy_dump(folder, "%s_offsets" % name, offsets)
+	npy_dump(folder, "%s_blob" % name, np.frombuffer(b"".join(blobs), dtype=np.uint8))
+
+
+class StringTable(object):
+	""" mmap 打开的字符串表，按下标取字符串 """
+
+	def __init__(self, folder, name):
+		self.offsets = npy_load(folder, "%s_offsets" % name)
+		self.blob = npy_load(folder, "%s_blob" % name)
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def __getitem__(self, idx):
+		return bytes(self.blob[self.offsets[idx]:self.offsets[idx+1]]).decode("utf-8")
+
+	def __iter__(self):
+		return (self[idx] for idx in range(len(self)))
+
+
 
 class TFIDF(object):
 
@@ -44,11 +107,22 @@ class TFIDF(object):
 	IDF_Dict_File = 'idf_dict.pkl' # idf 词频表
 
 	Fragments_File = 'fragments.pkl' # 每一篇文章分好的词
+	Fragments_Hash_File = 'fragments_hash.pkl' # 每一篇文章分词时正文的 MD5
+	Doc_Freq_File = 'doc_freq.pkl' # 每个词出现在多少篇文章中
 	Key_Words_File = 'key_words.pkl' # 每一篇文章的关键词
 	Mono_Words_File = 'mono_words.pkl' # 只在一篇文章中出现过的词
 
-	Key_Words_List_File = 'keywords_list.pkl' # bins 中 array 的索引
-	Bins_File = 'bins.pkl' # 每一篇文章的基于 keywordsList 生成的 bins array
+	Model_Dir = 'tfidf_model' # 匹配用的模型，均为可 mmap 的 .npy 文件，见 dump_model
+	Model_Version = 3
+
+	Neighbors_Top = 30 # 预计算的相似文章数 K
+
+	Lsh_Bands = 64 # MinHash 签名分段数
+	Lsh_Band_Rows = 2 # 每段签名长度，Tc = 0.2 时成为候选的概率约为 0.93
+	Lsh_Seed = 0
+
+	Duplicate_Threshold = 0.8 # 关键词集合 Tc 不小于该值即视为重复文
+	Duplicate_Block = 64 # 查重时每次计算的行数
 
 
 	def __init__(self):
@@ -56,40 +130,137 @@ class TFIDF(object):
 		#self.monoWords = pkl_load(self.Mono_Words_File)
 		#self.idfDict = pkl_load(self.IDF_Dict_File)
 		#self.bins = pkl_load(self.Bins_File)
-		with SQLiteDB() as newsDB:
+		with SQLiteDB(readonly=True) as newsDB:
 			self.discard_newsIDs = frozenset(newsDB.get_discard_newsIDs())
+			self.duplicate_newsIDs = frozenset(newsDB.get_duplicate_newsIDs()) # 重复文中非首发的文章，不作为推荐结果
+		self.exclude_newsIDs = self.discard_newsIDs | self.duplicate_newsIDs
 
 	def init_for_update(self):
 		self.stopWords = pkl_load(self.Stop_Words_File)
 		return self
 
-	def init_for_match(self):
-		self.bins = pkl_load(self.Bins_File,log=False)
-		# self.bins = {newsID: _bin.astype(np.int8) for newsID, _bin in self.bins.items()}
+	def init_for_match(self, method="Tc", packed=False, neighbors=True, lsh=False, modelDir=None):
+		if method not in ("Tc","CosDist"):
+			raise ValueError("unexpected match method '%s' !" % method)
+		self.method = method
+		self.packed = packed
+
+		self.modelDir = modelDir = modelDir or os.path.join(cachedir, self.Model_Dir)
+		self.meta = json_load(modelDir, "meta.json", log=False)
+		if self.meta["version"] != self.Model_Version:
+			raise ValueError("unexpected model version %s !" % self.meta["version"])
+
+		self.newsIDs = npy_load(modelDir, "newsIDs").tolist() # row -> newsID
+		self.counts = npy_load(modelDir, "counts") # 每一行的关键词数
+		self.indptr = npy_load(modelDir, "rows_indptr") # CSR: 每一篇文章的关键词所在的列
+		self.indices = npy_load(modelDir, "rows_indices")
+
+		if method == "CosDist": # 基于 tfidf 权重的余弦相似度
+			if sparse is None:
+				raise ImportError("scipy is required for method 'CosDist' !")
+			self.weights = sparse.csr_matrix((npy_load(modelDir, "rows_weights"), self.indices, self.indptr),
+				shape=(self.meta["count"], self.meta["keywords"]), copy=False)
+		elif packed: # 按位压缩的指纹，内存约为 bins 的 1/8
+			self.fingerprints = npy_load(modelDir, "fingerprints") # 按列存储，取列时内存连续
+			self.fingerprintShape = (1, self.meta["keywords"])
+		else: # 倒排表，CSC: 每一个关键词出现在哪些文章中
+			self.colsIndptr = npy_load(modelDir, "cols_indptr")
+			self.colsIndices = npy_load(modelDir, "cols_indices")
+
+		self.rows = {newsID: row for row, newsID in enumerate(self.newsIDs)} # newsID -> row
+		self.discardRows = [self.rows[newsID] for newsID in self.exclude_newsIDs if newsID in self.rows]
+		if neighbors and self.meta.get("neighborsMethod") == method: # 只使用由同一方法算出的表
+			self.neighborsTop = self.meta["neighborsTop"]
+			self.neighbors = npy_load(modelDir, "neighbors")
+			self.neighborScores = npy_load(modelDir, "neighbor_scores")
+		else:
+			self.neighborsTop, self.neighbors, self.neighborScores = 0, None, None
+		self.lsh = lsh
+		if lsh: # MinHash LSH: 只对候选文章精确计算相似度
+			lshMeta = self.meta["lsh"]
+			self.lshBands = lshMeta["bands"]
+			self.lshParams = hash_params(lshMeta["bands"] * lshMeta["rows"], lshMeta["seed"])
+			self.lshKeys = npy_load(modelDir, "lsh_keys")
+			self.lshRows = npy_load(modelDir, "lsh_rows")
+		self.keyCols = None # 供 recommend_by_text 使用，首次调用时再载入
 		return self
 
+	def init_for_text(self):
+		""" 载入对任意文本提取关键词所需的停词表、词表和关键词列
+
+			各线程共用同一个对象，recommend_by_text 以 keyCols 是否为 None 判断是否已载入，
+			因此先在局部变量中建好，keyCols 最后赋值
+		"""
+		keyCols = {word: col for col, word in enumerate(StringTable(self.modelDir, "keywords"))}
+		idfDict = dict(zip(StringTable(self.modelDir, "vocab"), npy_load(self.modelDir, "idf").tolist()))
+		self.stopWords = pkl_load(self.Stop_Words_File, log=False)
+		self.monoWords = frozenset() # 词表中已去掉只出现一次的词
+		self.idfDict = idfDict
+		self.keyCols = keyCols
+
 	def cut(self, news):
 		for word in jieba.cut(news):
-			if not isChinese(word) or len(word.strip()) <= 1 or word in self.stopWords:
-				continue
-			else:
+			if is_word(self.stopWords, word):
 				yield word.strip()
 
 	def lcut(self, news):
 		return list(self.cut(news))
 
+	def cut_many(self, newsContents, desc="cut news"):
+		""" 多进程分词，返回 {newsID: words} """
+		fragments = cut_corpus((news["content"] for news in newsContents), partial(is_word, self.stopWords),
+			processes=None if len(newsContents) > 64 else 1) # 文章很少时不必开进程池
+		return {news["newsID"]: words for news, words in zip(newsContents, show_status(fragments, desc))}
+
 	def get_fragments(self, fromCache=False):
 		if fromCache:
-			return
+			self.fragments = pkl_load(self.Fragments_File)
+			self.docFreq = pkl_load(self.Doc_Freq_File)
 		else:
 			with SQLiteDB() as newsDB:
 				newsContents = newsDB.select("newsContent",("newsID","content")).fetchall()
 				newsContents = [news for news in newsContents if news["newsID"] not in self.discard_newsIDs]
-			fragments = {news["newsID"]: self.lcut(news["content"]) for news in show_status(newsContents, "cut news")}
-			pkl_dump(self.Fragments_File, fragments)
+			self.fragments = self.cut_many(newsContents)
+			self.docFreq = Counter(iter_flat([list(set(words)) for newsID, words in self.fragments.items()]))
+			pkl_dump(self.Fragments_File, self.fragments)
+			pkl_dump(self.Fragments_Hash_File, {news["newsID"]: MD5(news["content"]) for news in newsContents})
+			pkl_dump(self.Doc_Freq_File, self.docFreq)
+
+	def update_fragments(self):
+		""" 只对新增或正文有改动的文章分词，并增量更新文档频率 """
+		fragments = pkl_load(self.Fragments_File, default={})
+		hashes = pkl_load(self.Fragments_Hash_File, default={})
+		docFreq = pkl_load(self.Doc_Freq_File, default=Counter())
+		if not docFreq: # 旧缓存中没有文档频率
+			docFreq = Counter(iter_flat([list(set(words)) for newsID, words in fragments.items()]))
+
+		with SQLiteDB() as newsDB:
+			newsContents = newsDB.select("newsContent",("newsID","content")).fetchall()
+			newsContents = [news for news in newsContents if news["newsID"] not in self.discard_newsIDs]
+
+		nowNewsIDs = {news["newsID"] for news in newsContents}
+		for newsID in set(fragments) - nowNewsIDs: # 已删除或已下架的文章
+			docFreq.subtract(set(fragments.pop(newsID)))
+			hashes.pop(newsID, None)
+
+		changed = [news for news in newsContents if hashes.get(news["newsID"]) != MD5(news["content"])]
+		for newsID, words in self.cut_many(changed).items():
+			if newsID in fragments: # 正文有改动，先减去旧的文档频率
+				docFreq.subtract(set(fragments[newsID]))
+			fragments[newsID] = words
+			docFreq.update(set(words))
+		hashes.update({news["newsID"]: MD5(news["content"]) for news in changed})
+
+		logger.info("cut %s news, %s in total" % (len(changed), len(fragments)))
+
+		self.fragments = fragments
+		self.docFreq = +docFreq # 去掉计数为 0 的词
+		pkl_dump(self.Fragments_File, self.fragments)
+		pkl_dump(self.Fragments_Hash_File, hashes)
+		pkl_dump(self.Doc_Freq_File, self.docFreq)
 
 	def get_idfDict(self):
-		wordsSum = Counter(iter_flat([list(set(words)) for newsID, words in self.fragments.items()]))
+		wordsSum = self.docFreq
 
 		monoWords = {word for word, freq in wordsSum.items() if freq <= 1} # 只出现一次的词
 		pkl_dump(self.Mono_Words_File, monoWords)
@@ -101,51 +272,309 @@ class TFIDF(object):
 		#write_csv(cachedir,'idf_dict.csv',['word','idf'],[dict(zip(["word","idf"], [k,v])) for k,v in sorted(idfDict.items(),key=lambda x:x[1],reverse=True)])
 
 	def extract(self, words, top=100, weight=False):
-		words = [word for word in words if word not in self.monoWords] # 过滤掉只出现一次的词
+		words = [word for word in words if word not in self.monoWords and word in self.idfDict] # 过滤掉只出现一次的词和未收录的词
 		wordsTotal = len(words)
 		tf_idf = {word:freq/wordsTotal*self.idfDict[word] for word,freq in Counter(words).items()}
 		keyWords = sorted(tf_idf.items(), key=lambda item: item[1], reverse=True)[:top]
 		return keyWords if weight else [item[0] for item in keyWords]
 
-	def get_bins(self):
-		keyWords = {newsID: self.extract(words)	for newsID, words in self.fragments.items()}
+	def get_bins(self, incremental=False):
+		keyWordsWeight = {newsID: self.extract(words, weight=True) for newsID, words in self.fragments.items()}
+		keyWords = {newsID: [item[0] for item in items] for newsID, items in keyWordsWeight.items()}
 		pkl_dump(self.Key_Words_File, keyWords)
 
-		uniqueKeyWords = list(set(iter_flat(keyWords.values())))
-		pkl_dump(self.Key_Words_List_File, uniqueKeyWords)
-
-		bins = {newsID:np.array([(word in words) for word in uniqueKeyWords])
-			for newsID, words in show_status(keyWords.items(), "get bins")}
-
-		pkl_dump(self.Bins_File, bins)
-
-
-	def update(self):
-		self.get_fragments(fromCache=False)
-		self.fragments = pkl_load(self.Fragments_File)
+		modelDir = os.path.join(cachedir, self.Model_Dir)
+		if incremental and os.path.exists(modelDir): # 沿用旧模型的列顺序，新词追加到末尾
+			uniqueKeyWords = list(StringTable(modelDir, "keywords"))
+		else:
+			uniqueKeyWords = []
+		knownKeyWords = set(uniqueKeyWords)
+		uniqueKeyWords += list(set(iter_flat(keyWords.values())) - knownKeyWords)
+
+		return keyWordsWeight, uniqueKeyWords
+
+	def dump_model(self, folder, keyWordsWeight, uniqueKeyWords):
+		""" 写出匹配用的模型文件夹
+
+			meta.json                    版本号、文章数、关键词数、预计算的相似文章表信息
+			newsIDs.npy                  row -> newsID
+			keywords_{offsets,blob}.npy  col -> 关键词，字符串表
+			counts.npy                   每一篇文章的关键词数
+			rows_{indptr,indices}.npy    CSR: 每一篇文章的关键词所在的列
+			rows_weights.npy             CSR: 对应的 tfidf 权重，按行 L2 归一化
+			cols_{indptr,indices}.npy    CSC: 每一个关键词出现在哪些文章中（倒排表）
+			fingerprints.npy             按位压缩的 uint64 指纹，按列存储
+			vocab_{offsets,blob}.npy     词表，不含只出现一次的词，字符串表
+			idf.npy                      词表中每个词的 idf
+			lsh_{keys,rows}.npy          MinHash LSH 的分桶键（已排序）及其所在的行
+		"""
+		os.makedirs(folder)
+		newsIDs = list(keyWordsWeight.keys())
+		cols = {word: col for col, word in enumerate(uniqueKeyWords)}
+		shape = (len(newsIDs), len(uniqueKeyWords))
+
+		indptr, indices, weights = [0], [], []
+		for items in keyWordsWeight.values():
+			indices.extend(cols[word] for word, weight in items)
+			weights.extend(weight for word, weight in items)
+			indptr.append(len(indices))
+		indptr = np.array(indptr, dtype=np.int32)
+		indices = np.array(indices, dtype=np.int32)
+		weights = np.array(weights, dtype=np.float32)
+
+		counts = np.diff(indptr)
+		rows = np.repeat(np.arange(shape[0], dtype=np.int32), counts) # 每个非零元所在的行
+		norms = np.sqrt(np.bincount(rows, weights=weights**2, minlength=shape[0]))
+		weights /= np.where(norms > 0, norms, 1)[rows] # L2 归一化，点积即余弦相似度
+
+		order = np.argsort(indices, kind="stable")
+		colsIndptr = np.zeros(shape[1]+1, dtype=np.int32)
+		colsIndptr[1:] = np.cumsum(np.bincount(indices, minlength=shape[1]))
+
+		json_dump(folder, "meta.json", {
+			"version": self.Model_Version,
+			"count": shape[0],
+			"keywords": shape[1],
+			"lsh": {"bands": self.Lsh_Bands, "rows": self.Lsh_Band_Rows, "seed": self.Lsh_Seed},
+		}, log=False)
+		npy_dump(folder, "newsIDs", np.array(newsIDs, dtype=str))
+		strings_dump(folder, "keywords", uniqueKeyWords)
+		npy_dump(folder, "counts", counts)
+		npy_dump(folder, "rows_indptr", indptr)
+		npy_dump(folder, "rows_indices", indices)
+		npy_dump(folder, "rows_weights", weights)
+		npy_dump(folder, "cols_indptr", colsIndptr)
+		npy_dump(folder, "cols_indices", rows[order])
+		npy_dump(folder, "fingerprints", np.asfortranarray(packbins(rows, indices, shape)))
+
+		vocab = [word for word in self.idfDict if word not in self.monoWords]
+		strings_dump(folder, "vocab", vocab)
+		npy_dump(folder, "idf", np.array([self.idfDict[word] for word in vocab], dtype=np.float64))
+
+		params = hash_params(self.Lsh_Bands * self.Lsh_Band_Rows, self.Lsh_Seed)
+		lshKeys, lshRows = lsh_build(band_keys(signatures(indptr, indices, *params), self.Lsh_Bands))
+		npy_dump(folder, "lsh_keys", lshKeys)
+		npy_dump(folder, "lsh_rows", lshRows)
+
+	def swap_model(self, folder):
+		""" 用新的模型文件夹替换旧的，已打开旧模型的 worker 不受影响 """
+		modelDir = os.path.join(cachedir, self.Model_Dir)
+		oldDir = modelDir + ".old"
+		if os.path.exists(oldDir):
+			shutil.rmtree(oldDir)
+		if os.path.exists(modelDir):
+			os.rename(modelDir, oldDir)
+		os.rename(folder, modelDir)
+		if os.path.exists(oldDir):
+			shutil.rmtree(oldDir)
+		logger.info("swap %s" % self.Model_Dir)
+
+
+	def update(self, incremental=False):
+		if incremental: # 日常更新，只处理新增或改动的文章
+			self.update_fragments()
+		else:
+			self.get_fragments(fromCache=False)
 
 		self.get_idfDict()
 		self.idfDict = pkl_load(self.IDF_Dict_File)
 		self.monoWords = pkl_load(self.Mono_Words_File)
 
-		self.get_bins()
-
+		keyWordsWeight, uniqueKeyWords = self.get_bins(incremental=incremental)
+
+		tmpDir = os.path.join(cachedir, self.Model_Dir + ".tmp")
+		if os.path.exists(tmpDir):
+			shutil.rmtree(tmpDir)
+		self.dump_model(tmpDir, keyWordsWeight, uniqueKeyWords)
+
+		self.init_for_match(neighbors=False, modelDir=tmpDir)
+		self.get_neighbors()
+
+		self.swap_model(tmpDir)
+
+	def get_neighbors(self, top=None):
+		""" 预先计算每一篇文章的前 top 篇相似文章，写入当前模型文件夹 """
+		top = top or self.Neighbors_Top
+		neighbors = np.full((len(self.newsIDs), top), -1, dtype=np.int32) # 不足 top 篇时以 -1 补齐
+		neighborScores = np.zeros((len(self.newsIDs), top), dtype=np.float32)
+		for row in show_status(range(len(self.newsIDs)), "get neighbors"):
+			similarity = self.get_similarity(row)
+			rows = self.get_top_rows(similarity, top)
+			neighbors[row,:len(rows)] = rows
+			neighborScores[row,:len(rows)] = similarity[rows]
+
+		npy_dump(self.modelDir, "neighbors", neighbors)
+		npy_dump(self.modelDir, "neighbor_scores", neighborScores)
+		self.meta.update({"neighborsMethod": self.method, "neighborsTop": top})
+		json_dump(self.modelDir, "meta.json", self.meta, log=False)
+
+
+	def get_duplicates(self, threshold=None):
+		""" 找出关键词集合 Tc >= threshold 的重复文，返回 [[primaryID, newsID, ...], ...]
+
+			每次取 Duplicate_Block 行，把它们的倒排表拼起来一次计数，只比较 row < other 的文章对
+			按发文顺序以最早的一篇为首发做星形聚类：每篇重复文与本组首发的 Tc 都不小于 threshold ，
+			不会像连通分量那样经 A~B~C 的链条把不相似的文章连成一组
+		"""
+		threshold = threshold or self.Duplicate_Threshold
+		count = len(self.newsIDs)
+		discard = np.zeros(count, dtype=bool)
+		discard[[self.rows[newsID] for newsID in self.discard_newsIDs if newsID in self.rows]] = True # 下架文章不参与查重
+
+		similars = {} # row -> {Tc >= threshold 的 other, ...}
+		for start in show_status(range(0, count, self.Duplicate_Block), "get duplicates"):
+			block = np.arange(start, min(start + self.Duplicate_Block, count))
+			cols = self.indices[self.indptr[block[0]]:self.indptr[block[-1]+1]] # 这些行的关键词是连续存放的
+			lens = self.colsIndptr[cols+1] - self.colsIndptr[cols] # 每个关键词的倒排表长度
+			postings = self.colsIndices[np.repeat(self.colsIndptr[cols] - np.cumsum(lens) + lens, lens) + np.arange(lens.sum())]
+			labels = np.repeat(np.repeat(np.arange(len(block), dtype=np.int64) * count, self.counts[block]), lens)
+			dots = np.bincount(labels + postings, minlength=len(block)*count).reshape(len(block), count)
+			dots[np.arange(count) <= block[:,None]] = 0 # 只保留上三角
+			dots[:, discard] = 0
+			dots[discard[block]] = 0
+			rows, others = np.nonzero(dots)
+			dots = dots[rows, others]
+			rows = block[rows]
+			Tcs = dots / (self.counts[rows] + self.counts[others] - dots)
+			for row, other in zip(rows[Tcs >= threshold].tolist(), others[Tcs >= threshold].tolist()):
+				similars.setdefault(row, set()).add(other)
+				similars.setdefault(other, set()).add(row)
+
+		with SQLiteDB(readonly=True) as newsDB:
+			sendTime = {news["newsID"]: (news["masssend_time"], news["idx"]) for news in
+				newsDB.select("newsInfo", ("newsID","masssend_time","idx")).fetchall()}
+		order = sorted(similars, key=lambda row: (self.newsIDs[row] not in sendTime, # newsInfo 中没有的文章排在最后
+			sendTime.get(self.newsIDs[row], ()), self.newsIDs[row]))
+		ranks = {row: rank for rank, row in enumerate(order)}
+
+		clusters = []
+		assigned = set()
+		for row in order: # 先发的文章先成为首发，更早的文章都已处理过，未分组的相似文章必然晚于它
+			if row in assigned:
+				continue
+			members = sorted(similars[row] - assigned, key=ranks.get)
+			if members == []:
+				continue
+			assigned.add(row)
+			assigned.update(members)
+			clusters.append([self.newsIDs[row]] + [self.newsIDs[other] for other in members])
+		return clusters
+
+
+	def get_top_rows(self, similarity, count):
+		""" 从相似度数组中取出前 count 个非零结果的行号，按相似度降序排列 """
+		count = min(count, np.count_nonzero(similarity > 0))
+		if count <= 0:
+			return np.array([], dtype=np.int64)
+		rows = np.argpartition(-similarity, count-1)[:count]
+		return rows[np.argsort(-similarity[rows], kind="stable")]
+
+	def get_tops(self, similarity, count):
+		return {self.newsIDs[row]: float(similarity[row]) for row in self.get_top_rows(similarity, count)}
+
+	def get_similarity(self, row):
+		""" 计算第 row 篇文章与所有文章的相似度 """
+		cols = self.indices[self.indptr[row]:self.indptr[row+1]]
+		weights = self.weights[row] if self.method == "CosDist" else None
+		return self.get_similarity_by_cols(cols, self.counts[row], weights)
+
+	def get_similarity_by_cols(self, cols, count, weights=None):
+		""" 计算一组关键词与所有文章的相似度
+
+			cols     关键词所在的列
+			count    关键词总数，可能包含不在列中的词
+			weights  CosDist 时为 1 x keywords 的归一化 tfidf 稀疏向量
+		"""
+		if self.method == "CosDist":
+			similarity = (self.weights @ weights.T).toarray().ravel() # 稀疏矩阵乘向量
+			similarity[similarity >= 1 - 1e-6] = 0 # 余弦为 1 说明是相同文
+			similarity[self.discardRows] = 0
+			return similarity
+		elif self.packed:
+			fingerprint = packbins(np.zeros(len(cols), dtype=np.int32), np.asarray(cols), self.fingerprintShape)[0]
+			words = np.flatnonzero(fingerprint) # 只需比较非零的 uint64
+			dots = popcount(self.fingerprints[:, words] & fingerprint[words])
+		else: # 二值向量的矩阵乘：把每个关键词的倒排表拼起来，按行计数
+			postings = [self.colsIndices[self.colsIndptr[col]:self.colsIndptr[col+1]] for col in cols]
+			dots = np.bincount(np.concatenate(postings), minlength=len(self.newsIDs)) if postings else 0
+		with np.errstate(divide="ignore", invalid="ignore"):
+			Tcs = dots / (self.counts + count - dots)
+		Tcs[np.isnan(Tcs) | (Tcs == 1)] = 0 # Tc == 1 说明是相同文
+		Tcs[self.discardRows] = 0
+		return Tcs
+
+	def get_candidates(self, cols):
+		""" 通过 MinHash LSH 找出与一组关键词可能相似的文章所在的行 """
+		keys = band_keys(signature(cols, *self.lshParams), self.lshBands)[0]
+		return lsh_query(self.lshKeys, self.lshRows, keys)
+
+	def get_similarity_of_rows(self, rows, cols, count, weights=None):
+		""" 与 get_similarity_by_cols 相同，但只计算 rows 这些行 """
+		if self.method == "CosDist":
+			similarity = (self.weights[rows] @ weights.T).toarray().ravel()
+			similarity[similarity >= 1 - 1e-6] = 0
+		else: # 把各行的关键词拼起来，按行统计落在 cols 中的个数
+			lens = self.counts[rows]
+			starts = np.repeat(self.indptr[rows] - np.cumsum(lens) + lens, lens) + np.arange(lens.sum())
+			dots = np.bincount(np.repeat(np.arange(len(rows)), lens),
+				weights=np.isin(self.indices[starts], cols), minlength=len(rows))
+			with np.errstate(divide="ignore", invalid="ignore"):
+				similarity = dots / (lens + count - dots)
+			similarity[np.isnan(similarity) | (similarity == 1)] = 0
+		similarity[np.isin(rows, self.discardRows)] = 0
+		return similarity
+
+	def match_by_cols(self, cols, count, limit, weights=None):
+		""" 与一组关键词最相似的 limit 篇文章，启用 LSH 时候选不足则退回全量计算 """
+		if self.lsh:
+			rows = self.get_candidates(cols)
+			similarity = self.get_similarity_of_rows(rows, cols, count, weights)
+			tops = self.get_top_rows(similarity, limit)
+			if len(tops) >= limit:
+				return {self.newsIDs[rows[idx]]: float(similarity[idx]) for idx in tops}
+		return self.get_tops(self.get_similarity_by_cols(cols, count, weights), limit)
 
 	def match(self, newsID, count):
 		if newsID in self.discard_newsIDs:
-			raise ValueError("news %s has been discarded !")
-
-		thisBin = self.bins[newsID].astype(np.int8)
-		Tcs = {}
-		for newsID, otherBin in self.bins.items():
-			otherBin = otherBin.astype(np.int8)
-			dot, sum_x, sum_y = np.dot(thisBin, otherBin), np.sum(thisBin), np.sum(otherBin)
-			#logger.debug([dot, sum_x, sum_y])
-			Tc = dot / (sum_x + sum_y - dot)
-			if Tc not in [0, 1]: # Tc == 1 说明是相同文
-				Tcs[newsID] = Tc
-
-		return dict(sorted(Tcs.items(),key=lambda item: item[1],reverse=True)[:count])
+			raise ValueError("news %s has been discarded !" % newsID)
+
+		if newsID not in self.rows: # 上次建模之后发布的文章，按其正文实时计算
+			with SQLiteDB(readonly=True) as newsDB:
+				content = newsDB.single_cur.execute("SELECT content FROM newsContent WHERE newsID == ?", (newsID,)).fetchone()
+			if content is None:
+				return {}
+			return self.recommend_by_text(content, count)
+
+		row = self.rows[newsID]
+		if self.neighbors is not None and count <= self.neighborsTop: # 直接查表
+			neighbors = self.neighbors[row]
+			Tcs = [(self.newsIDs[_row], float(Tc)) for _row, Tc in zip(neighbors, self.neighborScores[row])
+				if _row >= 0 and self.newsIDs[_row] not in self.exclude_newsIDs]
+			if len(Tcs) >= count or neighbors[-1] < 0: # 过滤掉下架文章后不够，则实时计算
+				return dict(Tcs[:count])
+
+		cols = self.indices[self.indptr[row]:self.indptr[row+1]]
+		weights = self.weights[row] if self.method == "CosDist" else None
+		return self.match_by_cols(cols, self.counts[row], count, weights)
+
+	def recommend_by_text(self, text, count):
+		""" 对任意文本（如草稿）推荐相关文章：分词 -> 提取关键词 -> 与所有文章比较 """
+		if self.keyCols is None:
+			self.init_for_text()
+
+		keyWords = self.extract(self.lcut(text), weight=True)
+		inCols = [(word, weight) for word, weight in keyWords if word in self.keyCols] # 没有文章以之为关键词的词不参与点积
+		if not inCols:
+			return {}
+
+		cols = np.array([self.keyCols[word] for word, weight in inCols], dtype=np.int32)
+		weights = None
+		if self.method == "CosDist":
+			norm = np.linalg.norm([weight for word, weight in keyWords])
+			data = np.array([weight / norm for word, weight in inCols], dtype=np.float32)
+			weights = sparse.csr_matrix((data, cols, [0, len(cols)]), shape=(1, self.meta["keywords"]))
+
+		return self.match_by_cols(cols, len(keyWords), count, weights)
 
 
 if __name__ == '__main__':
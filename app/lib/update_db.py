@@ -4,6 +4,8 @@
 
 import os
 import re
+import threading
+from multiprocessing import cpu_count
 
 import chardet
 from datetime import datetime
@@ -11,18 +13,21 @@ from functools import partial
 
 from optparse import OptionParser
 
-import requests
+import jieba
 from urllib.parse import urlparse, parse_qs
 from bs4 import BeautifulSoup
 
-from whoosh.index import create_in, open_dir
-from whoosh.fields import Schema, TEXT # 不可直接 import × 否则与 datetime 冲突
+from whoosh.index import create_in, open_dir, exists_in
+from whoosh.fields import Schema, ID, TEXT # 不可直接 import × 否则与 datetime 冲突
+from whoosh.writing import MERGE_SMALL, NO_MERGE, CLEAR
 
 # 直接运行
 from utilfuncs import pkl_load, pkl_dump, show_status
 from utilclass import Logger, SQLiteDB
 from jieba_whoosh.analyzer import ChineseAnalyzer
 from tfidf import TFIDF
+from migrations import migrate, check_plans
+from crawler import Crawler, Checkpoint
 from static import StaticManager, Bg_Cover_Dir, Sm_Cover_Dir
 
 
@@ -47,25 +52,32 @@ class WxSpider(object):
 
 	reDigest = re.compile(r'var msg_desc = "(.*?)";')
 
+	Base_URL = "https://mp.weixin.qq.com" # 可指向本地的测试服务器
+	Page_Size = 7 # newmasssendpage 每页的群发数
+	Workers = 8 # 并发请求数
+	Rate = 5 # 每秒最多发出的请求数
+	Checkpoint_NewsContent = "newsContent.ckpt.jsonl" # 抓取正文的检查点，全部完成后删除
+
 	def __init__(self):
 		if self.__class__.cookies == '' or self.__class__.token == '':
 			raise Exception('cookies or token for WebSpider is missing !')
+		self.crawler = Crawler(self.headers, workers=self.Workers, rate=self.Rate)
 
 	@property
 	def headers(self):
 		return {
-			"Host": "mp.weixin.qq.com",
+			"Host": urlparse(self.Base_URL).netloc,
 			"User-Agent": "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/65.0.3325.181 Safari/537.36",
 			"Cookie": self.cookies,
-			"Referer": "https://mp.weixin.qq.com/cgi-bin/home?t=home/index&lang=zh_CN&token=%s" % self.token,
+			"Referer": "%s/cgi-bin/home?t=home/index&lang=zh_CN&token=%s" % (self.Base_URL, self.token),
 		}
 
 
 	def __get(self, url, params=None):
-		return requests.get(url=url, headers=self.headers, params=params)
+		return self.crawler.get(url, params=params)
 
-	def get_newsInfo(self, begin=0, count=7):
-		return self.__get("https://mp.weixin.qq.com/cgi-bin/newmasssendpage",{
+	def get_newsInfo(self, begin=0, count=Page_Size):
+		return self.__get(self.Base_URL + "/cgi-bin/newmasssendpage",{
 				'lang': 'zh_CN', 'f': 'json', 'ajax': 1,
 				'token' : self.token,
 				'begin': begin,
@@ -73,19 +85,15 @@ class WxSpider(object):
 			}).json()["sent_list"]
 
 	def batchget_newsInfo(self, begin=0):
-		def begin_generator():
-			begin = 0
-			while True:
-				yield begin
-				begin += 7
+		""" 每轮并发取 Workers 页，直到出现空页 """
 		totalNewsInfo = []
-		for begin in show_status(begin_generator(),"Getting newsInfo ..."):
-			newsInfo = self.get_newsInfo(begin)
-			if newsInfo != []:
+		while True:
+			begins = [begin + self.Page_Size * i for i in range(self.Workers)]
+			for newsInfo in self.crawler.map(self.get_newsInfo, begins, desc="Getting newsInfo from %s ..." % begin):
+				if newsInfo == []:
+					return totalNewsInfo
 				totalNewsInfo.extend(newsInfo)
-			else:
-				break
-		return totalNewsInfo
+			begin = begins[-1] + self.Page_Size
 
 	def get_newsContent(self, news):
 		html = self.__get(news["content_url"]).text
@@ -95,9 +103,14 @@ class WxSpider(object):
 		}
 
 	def batchget_newsContent(self, newsInfos):
-		for news in show_status(newsInfos,"Getting newsContent ..."):
-			news.update(self.get_newsContent(news))
+		""" 中断后重新运行时，已抓取的文章从检查点中读取 """
+		checkpoint = Checkpoint(os.path.join(cachedir, self.Checkpoint_NewsContent))
+		newsContents = self.crawler.map(self.get_newsContent, newsInfos,
+			key=lambda news: news["newsID"], checkpoint=checkpoint, desc="Getting newsContent ...")
+		for news, newsContent in zip(newsInfos, newsContents):
+			news.update(newsContent)
 			news.pop("content_url")
+		checkpoint.remove()
 		return newsInfos
 
 
@@ -148,6 +161,14 @@ class NewsDB(SQLiteDB):
 						FOREIGN KEY (newsID) REFERENCES newsInfo(newsID)
 					)
 				""" % tableName)
+			elif tableName == 'newsDuplicate': # 由 TFIDF 查重得到的重复文，primaryID 为同组中的首发文章
+				self.con.execute("""CREATE TABLE IF NOT EXISTS %s
+					(
+						newsID 			CHAR(11) PRIMARY KEY NOT NULL,
+						primaryID 		CHAR(11) NOT NULL,
+						FOREIGN KEY (newsID) REFERENCES newsInfo(newsID)
+					)
+				""" % tableName)
 
 			self.con.commit()
 		except Exception as err:
@@ -198,8 +219,8 @@ class NewsDB(SQLiteDB):
 				delete = oldNewsIDs - nowNewsIDs # 删除的文章
 				for newsID in delete:
 					pass'''
-				self.insert_many("newsInfo", newsDicts) # newsInfo 表中的阅读量是每天更新的，所以应该全部覆盖
-				logger.info("Table newsInfo Update Success !")
+				changes = self.upsert_many("newsInfo", newsDicts) # 阅读量每天变化，只写入有变化的行
+				logger.info("Table newsInfo Update Success ! %s rows changed" % changes)
 			else:
 				raise ValueError("unexpected method '%s' !" % method)
 
@@ -270,6 +291,22 @@ class NewsDB(SQLiteDB):
 			raise err
 
 
+	def update_table_newsDuplicate(self, clusters): # 基于 TFIDF.get_duplicates
+		try:
+			self.create_table("newsDuplicate", rebuild=True) # 每次全量重算
+			newsDuplicate = []
+			for newsIDs in clusters:
+				primaryID = newsIDs[0] # get_duplicates 已按发文顺序以最早的一篇为首发，组内其余文章都与它相似
+				newsDuplicate.extend({"newsID": newsID, "primaryID": primaryID} for newsID in newsIDs)
+
+			if newsDuplicate != []:
+				self.insert_many("newsDuplicate", newsDuplicate)
+			logger.info("Table newsDuplicate Update Success ! %s clusters" % len(clusters))
+
+		except Exception as err:
+			raise err
+
+
 
 class WhooshIdx(object):
 
@@ -279,42 +316,134 @@ class WhooshIdx(object):
 	if not os.path.exists(idxDir):
 		os.mkdir(idxDir)
 
+	Watermark_Key = "whoosh_content_seq" # dbMeta 中记录已建立索引的 newsContentLog 的最大 seq
+
+	Lean_Schema = True # 只存储 newsID ，标题、正文只建索引，不在索引中重复存储整个文章库
+	Content_Positions = False # 正文不记录词的位置，索引更小，但不支持对正文的短语检索
+
 	def __init__(self):
 		self.analyzer = ChineseAnalyzer()
 		self.schema = Schema(
-				newsID = TEXT(stored=True),
-				title = TEXT(stored=True, analyzer=self.analyzer),
-				content = TEXT(stored=True, analyzer=self.analyzer),
+				newsID = ID(stored=True, unique=True), # update_document 按 newsID 替换旧文档
+				title = TEXT(stored=not self.Lean_Schema, analyzer=self.analyzer),
+				content = TEXT(stored=not self.Lean_Schema, phrase=self.Content_Positions, analyzer=self.analyzer),
 			)
 
-	def add_news(self, newsList, ix=None):
+	def get_watermark(self, db):
+		""" 尚未记录时返回 None ，需全量更新 """
+		return db.single_cur.execute("SELECT value FROM dbMeta WHERE key == ?", (self.Watermark_Key,)).fetchone()
+
+	def set_watermark(self, db, watermark):
+		with db.con:
+			db.con.execute("INSERT OR REPLACE INTO dbMeta (key, value) VALUES (?, ?)", (self.Watermark_Key, watermark))
+			db.con.execute("DELETE FROM newsContentLog WHERE seq <= ?", (watermark,)) # 已写入索引的记录不再需要
+
+	def get_max_seq(self, db):
+		""" newsContentLog 的 seq 只增不减，清空后仍从 sqlite_sequence 中的值继续 """
+		return db.single_cur.execute("SELECT seq FROM sqlite_sequence WHERE name == 'newsContentLog'").fetchone() or 0
+
+	def add_news(self, newsList, ix=None, procs=1, mergetype=None):
 		if ix is None:
 			ix = open_dir(self.idxDir, schema=self.schema, indexname=self.idxName)
-		with ix.writer() as writer:
+		if procs > 1:
+			jieba.initialize() # 先加载词典，fork 出的子进程直接继承
+		writer = ix.writer(procs=procs, limitmb=256, multisegment=procs > 1) # 多进程时各自分词、各写一个段
+		try:
 			for news in show_status(newsList, "Add documents to %s" % self.idxName):
 				writer.add_document(**news)
+		except Exception as err:
+			writer.cancel()
+			raise err
+		else:
 			logger.info("Committing ...")
+			writer.commit(mergetype=mergetype)
 
 	def create_idx(self):
 		ix = create_in(self.idxDir, schema=self.schema, indexname=self.idxName)
 		logger.info("Creating %s" % self.idxName)
 		with NewsDB() as db:
+			watermark = self.get_max_seq(db)
 			newsContents = db.select("newsContent", ("newsID","title","content")).fetchall()
-			self.add_news(newsContents, ix)
+			self.add_news(newsContents, ix, procs=cpu_count())
+			self.set_watermark(db, watermark)
 		logger.info("%s create success !" % self.idxName)
 
+	def reindex(self):
+		""" 按当前的 schema 重建索引，如改为 Lean_Schema 后缩小已有的索引
+
+			先只提交新的 schema ，旧的段仍可检索；再写入全部文章，提交时清除旧的段，
+			检索端在 generation 变化后整体切换。与 create_in 不同，generation 继续递增
+		"""
+		if not exists_in(self.idxDir, indexname=self.idxName):
+			return self.create_idx()
+		ix = open_dir(self.idxDir, indexname=self.idxName)
+		logger.info("Reindexing %s" % self.idxName)
+		writer = ix.writer()
+		for name in ix.schema.names():
+			writer.remove_field(name)
+		for name, field in self.schema.items():
+			writer.add_field(name, field)
+		writer.commit(mergetype=NO_MERGE) # 多进程写入时子进程使用已提交的 schema
+
+		ix = open_dir(self.idxDir, indexname=self.idxName)
+		with NewsDB() as db:
+			watermark = self.get_max_seq(db)
+			newsContents = db.select("newsContent", ("newsID","title","content")).fetchall()
+			self.add_news(newsContents, ix, procs=cpu_count(), mergetype=CLEAR)
+			self.set_watermark(db, watermark)
+		logger.info("%s reindex success !" % self.idxName)
+
 	def update_idx(self):
-		ix = open_dir(self.idxDir, schema=self.schema, indexname=self.idxName)
+		""" 只写入 watermark 之后新增、替换或修改的文章，并删除 newsContent 中已不存在的文章
+
+			提交时不合并段，返回在后台合并小段的线程
+		"""
+		ix = open_dir(self.idxDir, indexname=self.idxName)
+		if not ix.schema["newsID"].unique: # 旧索引的 newsID 为 TEXT ，无法按 newsID 替换，重建一次
+			logger.info("newsID of %s is not unique, rebuild it" % self.idxName)
+			ix.close()
+			self.reindex()
+			return None
+
 		logger.info("Update %s" % self.idxName)
 		with NewsDB() as db:
-			nowNewsIDs = set(db.get_newsIDs())
-			with ix.searcher() as searcher:
-				oldNewsIDs = set(hit['newsID'] for hit in searcher.documents())
-			new = nowNewsIDs - oldNewsIDs
-			newsContents = db.select("newsContent", ("newsID","title","content")).fetchall()
-			newsContents = [news for news in newsContents if news["newsID"] in new]
-			self.add_news(newsContents, ix)
-		logger.info("%s update success !" % self.idxName)
+			watermark = self.get_watermark(db)
+			maxSeq = self.get_max_seq(db)
+			if watermark is None or watermark > maxSeq: # 首次增量更新，或 newsContentLog 被重建过
+				newsContents = db.select("newsContent", ("newsID","title","content")).fetchall()
+			else:
+				newsContents = db.cur.execute("""SELECT newsID, title, content FROM newsContent
+					WHERE newsID IN (SELECT newsID FROM newsContentLog WHERE seq > ?)""", (watermark,)).fetchall()
+			nowNewsIDs = set(db.single_cur.execute("SELECT newsID FROM newsContent").fetchall())
+
+		with ix.reader() as reader: # 词典中还有已删除但段未合并的文档的词，只取未删除的文档
+			oldNewsIDs = {fields["newsID"] for fields in reader.all_stored_fields()} # Lean_Schema 下只存储了 newsID
+		deleted = oldNewsIDs - nowNewsIDs
+
+		writer = ix.writer(limitmb=256)
+		try:
+			for newsID in deleted:
+				writer.delete_by_term("newsID", newsID)
+			for news in show_status(newsContents, "Update documents in %s" % self.idxName):
+				writer.update_document(**news)
+		except Exception as err:
+			writer.cancel()
+			raise err
+		else:
+			writer.commit(merge=False)
+
+		with NewsDB() as db:
+			self.set_watermark(db, maxSeq)
+		logger.info("%s update success ! %s updated, %s deleted" % (self.idxName, len(newsContents), len(deleted)))
+
+		merger = threading.Thread(target=self.merge, args=(ix,), name="merge %s" % self.idxName)
+		merger.start() # 非守护线程，进程退出前会等待其完成
+		return merger
+
+	def merge(self, ix):
+		""" 合并较小的段，检索端在 generation 变化后自动 refresh """
+		ix.writer().commit(mergetype=MERGE_SMALL)
+		logger.info("%s segments merged" % self.idxName)
 
 
 if __name__ == '__main__':
@@ -323,12 +452,25 @@ if __name__ == '__main__':
 	parser.add_option("-t", "--token", dest="token")
 	parser.add_option("-c", "--cookies", dest="cookies")
 	parser.add_option("-r", "--rebuild", dest="rebuild", action="store_true")
+	parser.add_option("-m", "--migrate", dest="migrate", action="store_true")
+	parser.add_option("-i", "--reindex", dest="reindex", action="store_true")
+	parser.add_option("-u", "--base-url", dest="baseURL") # 如 http://127.0.0.1:8000 ，用于对本地测试服务器运行
 	options, args = parser.parse_args()
 	token, cookies, rebuild = options.token, options.cookies, options.rebuild
 
-	if all([token,cookies]):
+	if options.migrate: # 只迁移数据库，并检查查询是否走索引
+		migrate(SQLiteDB.dbLink)
+		check_plans(SQLiteDB.dbLink)
+
+	elif options.reindex: # 只按当前的 schema 重建 whoosh 索引
+		migrate(SQLiteDB.dbLink)
+		WhooshIdx().reindex()
+
+	elif all([token,cookies]):
 		WxSpider.token = token
 		WxSpider.cookies = cookies
+		if options.baseURL:
+			WxSpider.Base_URL = options.baseURL.rstrip("/")
 
 		if rebuild: # 未测试 ！ 为修改静态
 			'''with NewsDB() as db:
@@ -357,14 +499,20 @@ if __name__ == '__main__':
 				db.update_table_newsInfo(method="rebuild", fromCache=False)
 				db.update_table_newsContent(method="rebuild", fromCache=False)
 				db.update_table_newsDetail(method="update")
+			migrate(SQLiteDB.dbLink, force=True) # 表可能被重建，重新应用全部迁移
 
-			WhooshIdx().create_idx()
+			WhooshIdx().reindex()
 			logger.info("update TFIDF ...")
 			tfidf = TFIDF().init_for_update()
 			tfidf.update()
 			logger.info("update TFIDF success !")
 
+			with NewsDB() as db:
+				db.update_table_newsDuplicate(TFIDF().init_for_match(neighbors=False).get_duplicates())
+				db.bump_generation() # 全部更新完成后再使接口的结果缓存失效
+
 		else: # 用于日常更新
+			migrate(SQLiteDB.dbLink)
 			with NewsDB() as db:
 				db.update_table_newsInfo(fromCache=False)
 				newsIDs = db.get_newsIDs()
@@ -389,9 +537,13 @@ if __name__ == '__main__':
 			WhooshIdx().update_idx()
 			logger.info("update TFIDF ...")
 			tfidf = TFIDF().init_for_update()
-			tfidf.update()
+			tfidf.update(incremental=True)
 			logger.info("update TFIDF success !")
 
+			with NewsDB() as db:
+				db.update_table_newsDuplicate(TFIDF().init_for_match(neighbors=False).get_duplicates())
+				db.bump_generation() # 全部更新完成后再使接口的结果缓存失效
+
 		if rebuild:
 			logger.info("rebuild done !")
 		else:
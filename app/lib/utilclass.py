@@ -6,8 +6,13 @@ import os
 import sys
 import time
 import re
+import json
+import threading
+import itertools
+from queue import LifoQueue, Empty
+from urllib.request import pathname2url
 from datetime import datetime
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 import logging
 import requests
 import sqlite3
@@ -17,12 +22,15 @@ import pymongo
 # from email.utils import formataddr
 from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import JSONWebSignatureSerializer as Serializer
+from whoosh.index import open_dir
+from whoosh.qparser import MultifieldParser, PhrasePlugin
+from whoosh.idsets import BitSet
 
 
 try:
-	from .utilfuncs import pkl_load, pkl_dump, get_secret, iter_flat
+	from .utilfuncs import pkl_load, pkl_dump, get_secret, iter_flat, iter_split
 except (ImportError,SystemError,ValueError):
-	from utilfuncs import pkl_load, pkl_dump, get_secret, iter_flat
+	from utilfuncs import pkl_load, pkl_dump, get_secret, iter_flat, iter_split
 
 
 basedir = os.path.join(os.path.dirname(__file__),"../") # app根目录
@@ -35,7 +43,7 @@ __all__ = [
 	"Encipher",
 	"MongoDB",
 	"SQLiteDB",
-	#"WhooshIdx",
+	"WhooshIdx",
 	"WxAuth",
 ]
 
@@ -332,12 +340,154 @@ class MongoDB(object):
 		raise NotImplementedError
 
 
+class DictFactory(object):
+	""" dict 行工厂，列名只在 cursor.description 变化时（即每条语句）计算一次 """
+
+	def __init__(self):
+		self.description = None
+		self.names = ()
+
+	def __call__(self, cur, row):
+		description = cur.description
+		if description is not self.description:
+			self.description = description
+			self.names = tuple(col[0] for col in description)
+		return dict(zip(self.names, row))
+
+
+class RecordFactory(DictFactory):
+	""" namedtuple 行工厂，同样列名的语句共用一个 namedtuple 类 """
+
+	Record_Types = {} # 列名 -> namedtuple 类
+
+	def __call__(self, cur, row):
+		description = cur.description
+		if description is not self.description:
+			self.description = description
+			names = tuple(col[0] for col in description)
+			if names not in self.Record_Types:
+				self.Record_Types[names] = namedtuple("Record", names, rename=True) # 非法的列名改为 _0, _1 ...
+			self.names = self.Record_Types[names]
+		return self.names._make(row)
+
+
+def single_factory(cur, row):
+	return row[0]
+
+
+class SQLitePool(object):
+	""" 线程安全的只读连接池，同一进程内的各个线程借用、归还连接
+
+		连接以 mode=ro 打开，fork 之后的子进程会丢弃从父进程继承的连接
+		同一线程嵌套借用（如 NewsDB 的方法里再检查缓存、目录的 generation）时共用最外层借到的连接，
+		因此每个线程最多占用一个连接；连接数已满时最多等待 Acquire_Timeout 秒，
+		超时则临时打开一个连接，归还时直接关闭，不会无限阻塞
+	"""
+
+	Cached_Statements = 256 # 每个连接缓存的预编译语句数
+	Mmap_Size = 256 * 1024 * 1024
+	Cache_Size = -16 * 1024 # 负数表示 KiB
+	Acquire_Timeout = 1.0 # 等待其他线程归还连接的最长时间（秒）
+
+	logger = Logger(__name__)
+
+	def __init__(self, dbLink, size=8):
+		self.dbLink = dbLink
+		self.size = size
+		self.lock = threading.Lock()
+		self.__reset()
+		self.__enable_wal()
+
+	def __reset(self):
+		self.pid = os.getpid()
+		self.idle = LifoQueue()
+		self.opened = 0
+		self.local = threading.local() # 本线程借出的连接 con 、嵌套层数 depth 、是否为临时连接 temporary
+
+	def __enable_wal(self): # WAL 模式写入数据库文件，读者不会被写者阻塞，需用可写连接设置
+		con = sqlite3.connect(self.dbLink)
+		try:
+			con.execute("PRAGMA journal_mode = WAL")
+		except sqlite3.OperationalError: # 数据库正被占用，WAL 一经设置即持久生效，下次再设
+			pass
+		finally:
+			con.close()
+
+	def connect(self):
+		uri = "file:%s?mode=ro" % pathname2url(os.path.abspath(self.dbLink))
+		con = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=self.Cached_Statements,
+			isolation_level=None) # 自动提交，写临时表（见 bulk_ids）不会留下未结束的事务，使读取停留在旧的快照上
+		con.execute("PRAGMA mmap_size = %d" % self.Mmap_Size)
+		con.execute("PRAGMA cache_size = %d" % self.Cache_Size)
+		return con
+
+	def acquire(self):
+		with self.lock:
+			if self.pid != os.getpid():
+				self.__reset()
+			local = self.local
+		if getattr(local, "depth", 0) > 0: # 本线程已借出连接，嵌套借用时直接共用
+			local.depth += 1
+			return local.con
+		con, temporary = self.__take()
+		local.con, local.depth, local.temporary = con, 1, temporary
+		return con
+
+	def __take(self):
+		with self.lock:
+			try:
+				return self.idle.get_nowait(), False
+			except Empty:
+				pass
+			opening = self.opened < self.size
+			if opening:
+				self.opened += 1
+		if opening:
+			return self.connect(), False
+		try:
+			return self.idle.get(timeout=self.Acquire_Timeout), False # 连接数已满，等待其他线程归还
+		except Empty:
+			return self.connect(), True # 超时仍无空闲连接，临时打开一个
+
+	def release(self, con):
+		if self.pid != os.getpid(): # 父进程借出的连接不再放回
+			return
+		local = self.local
+		temporary = False
+		if getattr(local, "con", None) is con:
+			local.depth -= 1
+			if local.depth > 0: # 外层仍在使用
+				return
+			local.con, temporary = None, local.temporary
+		if temporary:
+			con.close()
+			return
+		if con.in_transaction: # 未结束的事务会让下一个借用者读到旧数据，并阻止 WAL checkpoint
+			self.logger.warning("pooled connection released inside a transaction, rollback")
+			con.rollback()
+		self.idle.put(con)
+
+
 class SQLiteDB(object):
 
 	dbLink = os.path.join(basedir,"database","pkuyouth.db")
 
-	def __init__(self):
-		self.con = sqlite3.connect(self.dbLink)
+	pools = {} # dbLink -> SQLitePool
+	poolsLock = threading.Lock()
+
+	hasJSON1 = None # sqlite 是否带 json1 扩展，首次批量查询时检测
+
+	Chunk_Size = 500 # 批量写入时每个事务的行数
+
+	Order_By_Time = (("i.date","DESC"), ("idx","ASC"), ("i.newsID","ASC")) # keyset 翻页的排序键，与 catalog.py 的 time_keys 对应
+	Order_By_Read = (("read_num","DESC"),) + Order_By_Time # 与 read_keys 对应
+
+	def __init__(self, readonly=False):
+		self.readonly = readonly
+		if readonly: # 只读时从连接池借用
+			self.con = self.get_pool().acquire()
+		else:
+			self.con = sqlite3.connect(self.dbLink)
 
 	def __enter__(self):
 		return self
@@ -346,27 +496,54 @@ class SQLiteDB(object):
 		self.close()
 
 	def close(self):
-		self.con.close()
+		if self.con is None: # 已经关闭或归还
+			return
+		if self.readonly:
+			self.get_pool().release(self.con)
+		else:
+			self.con.close()
+		self.con = None
 
-	@property
-	def cur(self):
+	@classmethod
+	def get_pool(cls):
+		with cls.poolsLock:
+			if cls.dbLink not in cls.pools:
+				cls.pools[cls.dbLink] = SQLitePool(cls.dbLink)
+			return cls.pools[cls.dbLink]
+
+	def cursor(self, mode="dict"):
+		""" 按 mode 返回各行：
+			dict    {列名: 值}
+			record  namedtuple ，可按属性或下标取值
+			tuple   sqlite3 原生的元组，最快
+			single  只取第一列
+		"""
 		cur = self.con.cursor()
-		cur.row_factory = self.Dict_Factory
+		if mode == "dict":
+			cur.row_factory = DictFactory()
+		elif mode == "record":
+			cur.row_factory = RecordFactory()
+		elif mode == "single":
+			cur.row_factory = single_factory
+		elif mode != "tuple":
+			raise ValueError("unexpected row mode '%s' !" % mode)
 		return cur
 
+	@property
+	def cur(self):
+		return self.cursor("dict")
+
 	@property
 	def single_cur(self):
-		cur = self.con.cursor()
-		cur.row_factory = self.Single_Factory
-		return cur
+		return self.cursor("single")
 
 	@property
 	def Dict_Factory(self):
-		return lambda cur,row: dict(zip([col[0] for col in cur.description],row))
+		return DictFactory()
 
 	@property
 	def Single_Factory(self):
-		return lambda cur,row: row[0]
+		return single_factory
 
 	@property
 	def Row(self):
@@ -380,10 +557,33 @@ class SQLiteDB(object):
 		return self.cur.executemany(*args,**kwargs)
 
 
-	def select(self, table, cols=()):
-		return self.cur.execute("SELECT %s FROM %s" % (",".join(cols), table))
+	def select(self, table, cols=(), mode="dict"):
+		return self.cursor(mode).execute("SELECT %s FROM %s" % (",".join(cols), table))
 
-	def select_join(self, cols=(), key="newsID", newsIDs=None):
+	def bulk_ids(self, newsIDs):
+		""" 批量 ID 查询的子查询，返回 (sql, params) ，用法为 WHERE newsID IN (sql)
+
+			优先用 json_each 把所有 ID 作为一个参数传入，语句不随 ID 个数变化，可以复用预编译结果，
+			也不受 SQLITE_MAX_VARIABLE_NUMBER 限制；没有 json1 时写入临时表
+		"""
+		newsIDs = list(newsIDs)
+		if SQLiteDB.hasJSON1 is None:
+			try:
+				self.con.execute("SELECT value FROM json_each('[]')")
+			except sqlite3.OperationalError:
+				SQLiteDB.hasJSON1 = False
+			else:
+				SQLiteDB.hasJSON1 = True
+		if SQLiteDB.hasJSON1:
+			return "SELECT value FROM json_each(?)", [json.dumps(newsIDs)]
+
+		self.con.execute("CREATE TEMP TABLE IF NOT EXISTS bulk_ids (newsID CHAR(11) PRIMARY KEY)") # 只读连接也可以写临时表
+		self.con.execute("DELETE FROM temp.bulk_ids")
+		for chunk in iter_split(newsIDs, 500):
+			self.con.executemany("INSERT OR IGNORE INTO temp.bulk_ids VALUES (?)", [(newsID,) for newsID in chunk])
+		return "SELECT newsID FROM temp.bulk_ids", []
+
+	def select_join(self, cols=(), key="newsID", newsIDs=None, mode="dict"):
 		""" cols 必须指定为 kw 否则传入一个元祖 会视为两个变量 ！！！！!
 			cols = (
 				("newsInfo",("newsID","title","masssend_time AS time")), # 可别名
@@ -409,10 +609,11 @@ class SQLiteDB(object):
 						key = '.'.join([table,key])
 					)
 		if newsIDs is not None:
-			sql += "WHERE {} IN ({})".format('.'.join([table0,key]), ','.join('?'*len(newsIDs)))
-			return self.cur.execute(sql, newsIDs)
+			idsSQL, params = self.bulk_ids(newsIDs)
+			sql += "WHERE {} IN ({})".format('.'.join([table0,key]), idsSQL)
+			return self.cursor(mode).execute(sql, params)
 		else:
-			return self.cur.execute(sql)
+			return self.cursor(mode).execute(sql)
 
 	def insert_one(self, table, dataDict):
 		k,v = tuple(zip(*dataDict))
@@ -421,14 +622,60 @@ class SQLiteDB(object):
 				% (table, ",".join(k), ",".join('?'*len(k))), v)
 			self.con.commit()
 
-	def insert_many(self, table, dataDicts):
-		dataDicts = [OrderedDict(sorted(dataDict.items())) for dataDict in dataDicts]
-		k = dataDicts[0].keys()
-		vs = [tuple(dataDict.values()) for dataDict in dataDicts]
-		with self.con:
-			self.con.executemany("INSERT OR REPLACE INTO %s (%s) VALUES (%s)"
-				% (table, ",".join(k), ",".join('?'*len(k))), vs)
-			self.con.commit()
+	@staticmethod
+	def __peek_cols(dataDicts):
+		""" 以第一行的键为列名，返回 (列名, 包括第一行在内的迭代器) ，没有数据时列名为 None """
+		dataDicts = iter(dataDicts)
+		first = next(dataDicts, None)
+		if first is None:
+			return None, dataDicts
+		return sorted(first), itertools.chain([first], dataDicts)
+
+	def __write_many(self, sql, cols, dataDicts, chunkSize):
+		""" 每 chunkSize 行一个事务，边读边写，返回实际写入的行数
+
+			写入期间 synchronous = NORMAL ，每个事务提交时不再等待 fsync ，
+			WAL 模式下断电最多丢失最后几个事务，不会损坏数据库
+		"""
+		synchronous = self.con.execute("PRAGMA synchronous").fetchone()[0]
+		self.con.execute("PRAGMA synchronous = NORMAL")
+		try:
+			changes = 0
+			for chunk in iter_split((dataDict for dataDict in dataDicts), chunkSize):
+				with self.con: # 出错时回滚当前块，已提交的块保留
+					self.con.execute("BEGIN IMMEDIATE")
+					cur = self.con.executemany(sql, [tuple(dataDict[col] for col in cols) for dataDict in chunk])
+					changes += cur.rowcount
+			return changes
+		finally:
+			self.con.execute("PRAGMA synchronous = %d" % synchronous)
+
+	def insert_many(self, table, dataDicts, chunkSize=Chunk_Size):
+		""" INSERT OR REPLACE ，dataDicts 可以是生成器 """
+		cols, dataDicts = self.__peek_cols(dataDicts)
+		if cols is None:
+			return 0
+		sql = "INSERT OR REPLACE INTO %s (%s) VALUES (%s)" % (table, ",".join(cols), ",".join('?'*len(cols)))
+		return self.__write_many(sql, cols, dataDicts, chunkSize)
+
+	def upsert_many(self, table, dataDicts, key="newsID", update=None, chunkSize=Chunk_Size):
+		""" 批量插入，key 已存在的行只在 update 中的列有变化时才更新，返回新增和更新的行数
+
+			update 默认为除 key 以外的全部列，dataDicts 可以是生成器
+			需要 sqlite 3.24 以上的 UPSERT 语法
+		"""
+		cols, dataDicts = self.__peek_cols(dataDicts)
+		if cols is None:
+			return 0
+		update = [col for col in cols if col != key] if update is None else list(update)
+		sql = "INSERT INTO %s (%s) VALUES (%s)" % (table, ",".join(cols), ",".join('?'*len(cols)))
+		if update:
+			sql += " ON CONFLICT (%s) DO UPDATE SET %s WHERE %s" % (key,
+				", ".join("%s = excluded.%s" % (col, col) for col in update),
+				" OR ".join("%s.%s IS NOT excluded.%s" % (table, col, col) for col in update))
+		else:
+			sql += " ON CONFLICT (%s) DO NOTHING" % key
+		return self.__write_many(sql, cols, dataDicts, chunkSize)
 
 	def update(self, table, newsID, newVal):
 		"""
@@ -450,15 +697,42 @@ class SQLiteDB(object):
 		return self.cur.execute("""SELECT {key}, count(*) AS count FROM {table} GROUP BY {key}
 			""".format(key=key,table=table)).fetchall()
 
-	def get_news_by_ID(self, newsID, orderBy='time DESC, idx ASC', filter_in_use=True):
-		if isinstance(newsID, str):
-			newsIDs = [newsID,]
-		elif isinstance(newsID, (list,tuple,set)):
-			newsIDs = list(newsID)
+	@staticmethod
+	def keyset(orderBy, after=None):
+		""" 游标翻页：取排序在 after 之后的行，返回 (where, params, orderBy)
+
+			orderBy = (("read_num","DESC"), ("i.newsID","ASC")) # 最后一项需唯一
+			after = [read_num, newsID] # 上一页最后一行的排序键
+		"""
+		order = ", ".join("%s %s" % key for key in orderBy)
+		if after is None:
+			return [], [], order
+		conds, params = [], []
+		for idx, (expr, direction) in enumerate(orderBy): # 前 idx 项相等，第 idx 项在其后
+			cond = ["%s == ?" % _expr for _expr, _direction in orderBy[:idx]]
+			cond.append("%s %s ?" % (expr, "<" if direction == "DESC" else ">"))
+			conds.append(" AND ".join(cond))
+			params.extend(after[:idx+1])
+		expr, direction = orderBy[0] # 先给出第一项的范围，便于沿索引顺序扫描
+		where = ["%s %s ?" % (expr, "<=" if direction == "DESC" else ">="), " OR ".join("(%s)" % cond for cond in conds)]
+		return where, [after[0]] + params, order
 
-		newsInfo = self.cur.execute("""
+	@classmethod
+	def news_sql(cls, where=(), params=(), orderBy='time DESC, idx ASC', limit=None, offset=0, filter_in_use=True, after=None):
+		""" 返回 select_news 执行的 (sql, params) ，migrations.check_plans 据此检查查询计划 """
+		where, params = list(where), list(params)
+		join = "INNER JOIN"
+		if not isinstance(orderBy, str):
+			_where, _params, orderBy = cls.keyset(orderBy, after)
+			where += _where
+			params += _params
+			join = "CROSS JOIN" # 固定以 newsInfo 为外层，沿排序键的索引扫描，取够 limit 行即停，不再按 d.column 取出后排序
+		if filter_in_use:
+			where.append("d.in_use")
+
+		sql = """
 				SELECT  title,
-						date(masssend_time) AS time,
+						i.date AS time,
 						-- cover AS cover_url,
 						sn,
 						-- content_url AS news_url,
@@ -466,15 +740,37 @@ class SQLiteDB(object):
 						read_num,
 						in_use,
 						i.newsID
-				FROM newsInfo AS i INNER JOIN newsDetail AS d ON i.newsID == d.newsID
-				WHERE i.newsID IN (%s)
-				ORDER BY %s
-			""" % (','.join('?'*len(newsIDs)), orderBy), newsIDs).fetchall()
+				FROM newsInfo AS i %s newsDetail AS d ON i.newsID == d.newsID
+			""" % join
+		if where:
+			sql += "WHERE %s \n" % " AND ".join("(%s)" % cond for cond in where)
+		sql += "ORDER BY %s \n" % orderBy
+		if limit is not None:
+			sql += "LIMIT ? OFFSET ?"
+			params += [limit, offset]
+		return sql, params
+
+	def select_news(self, where=(), params=(), orderBy='time DESC, idx ASC', limit=None, offset=0, filter_in_use=True, after=None, mode="dict"):
+		""" 按条件取文章，过滤、排序、分页均在 SQL 中完成
+
+			where = ["d.column == ?", "i.date == ?"] # 以 AND 连接
+			params = [column, date] # 与 where 中的 ? 对应
+			orderBy 为元组时按 keyset 翻页，after 为上一页最后一行的排序键，见 keyset
+
+			i.date 为 migrations.py 中添加的派生列，按 time 排序时可以走索引
+		"""
+		sql, params = self.news_sql(where, params, orderBy, limit, offset, filter_in_use, after)
+		return self.cursor(mode).execute(sql, params).fetchall()
 
-		if filter_in_use:
-			newsInfo = [news for news in newsInfo if news['in_use']]
+	def get_news_by_ID(self, newsID, orderBy='time DESC, idx ASC', filter_in_use=True, limit=None, offset=0, after=None, mode="dict"):
+		if isinstance(newsID, str):
+			newsIDs = [newsID,]
+		elif isinstance(newsID, (list,tuple,set)):
+			newsIDs = list(newsID)
 
-		return newsInfo
+		idsSQL, params = self.bulk_ids(newsIDs)
+		return self.select_news(["i.newsID IN (%s)" % idsSQL], params,
+			orderBy=orderBy, limit=limit, offset=offset, filter_in_use=filter_in_use, after=after, mode=mode)
 
 	def get_newsIDs(self):
 		return self.single_cur.execute("SELECT newsID FROM newsInfo").fetchall()
@@ -482,6 +778,215 @@ class SQLiteDB(object):
 	def get_discard_newsIDs(self):
 		return self.single_cur.execute("SELECT newsID FROM newsDetail WHERE in_use == 0").fetchall()
 
+	def get_duplicate_newsIDs(self):
+		""" 重复文中非首发的文章，由 update_db 的查重任务写入 newsDuplicate 表 """
+		try:
+			return self.single_cur.execute("SELECT newsID FROM newsDuplicate WHERE newsID != primaryID").fetchall()
+		except sqlite3.OperationalError: # 查重任务尚未运行过
+			return []
+
+	def get_generation(self):
+		""" 数据库的版本计数，每次更新数据后加一，见 migrations.py 中的 dbMeta 表 """
+		try:
+			return self.single_cur.execute("SELECT value FROM dbMeta WHERE key == 'generation'").fetchone()
+		except sqlite3.OperationalError: # 尚未迁移
+			return 0
+
+	def bump_generation(self):
+		""" 数据更新完成后调用，使各个进程中的结果缓存失效 """
+		with self.con:
+			self.con.execute("UPDATE dbMeta SET value = value + 1 WHERE key == 'generation'")
+
+
+
+class SearchCache(object):
+	""" 检索结果的 LRU 缓存，条目超过 ttl 秒或索引的 generation 变化后失效 """
+
+	def __init__(self, size=256, ttl=600):
+		self.size = size
+		self.ttl = ttl
+		self.lock = threading.Lock()
+		self.entries = OrderedDict() # key -> (generation, 写入时间, value)
+
+	def get(self, key, generation):
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is None:
+				return None
+			_generation, putTime, value = entry
+			if _generation != generation or time.time() - putTime > self.ttl:
+				del self.entries[key]
+				return None
+			self.entries.move_to_end(key)
+			return value
+
+	def put(self, key, generation, value):
+		with self.lock:
+			self.entries[key] = (generation, time.time(), value)
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.size:
+				self.entries.popitem(last=False)
+
+
+class WhooshIdx(object):
+	""" 只读的 whoosh 索引，供各个 worker 长期持有
+
+		每个线程持有自己的 searcher ，不必每次检索都重新打开段文件；
+		update_db 提交新的索引或修改数据库后 generation 变化，各线程在下次检索时 refresh ，
+		并在 load 中重新计算依赖于 docnum 的数据
+		子类覆盖 get_discard_newsIDs ，指定不出现在检索结果中的文章；
+		覆盖 get_ranges ，指定预先转为 BitSet 的检索范围
+	"""
+
+	Check_Interval = 1.0 # 两次检查 generation 的最短间隔（秒）
+	Filter_Cache_Size = 64 # 每个线程缓存的临时检索范围（如收藏）数
+
+	Search_Cache_Size = 256 # 每个 worker 缓存的检索结果数
+	Search_Cache_TTL = 600 # 检索结果最长缓存时间（秒），下架、改栏目等不改变索引的修改在此之后生效
+
+	def __init__(self, idxName="news_index_whoosh"):
+		self.idxName = idxName
+		self.idxDir = os.path.join(basedir,"database",idxName)
+		self.ix = open_dir(self.idxDir, indexname=idxName)
+		self.local = threading.local()
+		self.parsers = {} # fields -> MultifieldParser
+		self.searchCache = SearchCache(self.Search_Cache_Size, self.Search_Cache_TTL)
+		self.generation = self.__generation()
+		self.checkTime = time.time()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, trace):
+		self.close()
+
+	def close(self):
+		searcher = getattr(self.local, "searcher", None)
+		if searcher is not None:
+			searcher.close()
+			self.local.searcher = None
+		self.ix.close()
+
+	def __generation(self):
+		with SQLiteDB(readonly=True) as db:
+			dbGeneration = db.get_generation() # 下架、改栏目等只修改数据库
+		return (self.ix.latest_generation(), dbGeneration) # 只读取索引目录，不打开段文件
+
+	def check(self):
+		""" 返回 (索引, 数据库) 当前的 generation ，最多每 Check_Interval 秒读取一次 """
+		now = time.time()
+		if now - self.checkTime >= self.Check_Interval:
+			self.checkTime = now
+			generation = self.__generation()
+			if generation[0] != self.generation[0]: # 重建索引后 schema 可能变化
+				self.parsers = {}
+			self.generation = generation
+		return self.generation
+
+	def get_discard_newsIDs(self):
+		return []
+
+	def get_ranges(self):
+		""" {rangeKey: newsIDs} ，如 {("column","评论"): [...]} """
+		return {}
+
+	def load(self, searcher):
+		""" 当前线程换用新的 searcher 后调用，结果存放在 self.local 中 """
+		local = self.local
+		local.rels = {fields["newsID"]: docnum for docnum, fields in searcher.reader().iter_docs()} # newsID 与 docnum 的关系
+		local.docCount = searcher.doc_count_all()
+		local.discard_docnums = self.get_bitset(self.get_discard_newsIDs())
+		local.ranges = {rangeKey: self.get_bitset(newsIDs) for rangeKey, newsIDs in self.get_ranges().items()}
+		local.filters = OrderedDict() # frozenset(newsIDs) -> BitSet
+
+	def searcher(self):
+		""" 当前线程的 searcher ，只能在本线程中使用，不要关闭 """
+		generation = self.check()
+		local = self.local
+		if getattr(local, "searcher", None) is None:
+			local.searcher = self.ix.searcher()
+		elif local.generation != generation:
+			local.searcher = local.searcher.refresh() # 复用未变化的段，关闭旧的 searcher
+		else:
+			return local.searcher
+		local.generation = generation
+		self.load(local.searcher)
+		return local.searcher
+
+	def parser(self, fields):
+		""" 按字段缓存的解析器，ix.schema 每次访问都会读取 TOC 文件 """
+		fields = tuple(fields)
+		parser = self.parsers.get(fields)
+		if parser is None:
+			schema = self.ix.schema
+			parser = MultifieldParser(fields, schema=schema)
+			if not all(schema[field].format.supports("positions") for field in fields): # 不记录位置的字段无法短语检索
+				parser.remove_plugin_class(PhrasePlugin)
+			self.parsers[fields] = parser
+		return parser
+
+	def get_docnums(self, newsIDs):
+		""" 只能在 searcher() 之后调用，尚未建立索引的文章被忽略 """
+		rels = self.local.rels
+		return {rels[newsID] for newsID in newsIDs if newsID in rels}
+
+	def get_bitset(self, newsIDs):
+		return BitSet(self.get_docnums(newsIDs), size=self.local.docCount)
+
+	def has_range(self, rangeKey):
+		self.searcher()
+		return rangeKey in self.local.ranges
+
+	def get_filter(self, rangeKey=None, newsIDs=[]):
+		""" 检索范围对应的 BitSet ，rangeKey 为 get_ranges 中预先算好的范围，
+			否则由 newsIDs 临时转换并缓存；均未指定时返回 None ，即不过滤
+		"""
+		local = self.local
+		if rangeKey is not None:
+			return local.ranges.get(rangeKey) or BitSet()
+		if not newsIDs:
+			return None
+		key = frozenset(newsIDs)
+		bitset = local.filters.get(key)
+		if bitset is None:
+			bitset = local.filters[key] = self.get_bitset(key)
+			while len(local.filters) > self.Filter_Cache_Size:
+				local.filters.popitem(last=False)
+		else:
+			local.filters.move_to_end(key)
+		return bitset
+
+	def search_strings(self, querystring, fields, limit, newsIDs=[], rangeKey=None):  # 如果没有制定范围，则无filters
+		query = self.parser(fields).parse(querystring)
+		searcher = self.searcher()
+		docFilter = self.get_filter(rangeKey, newsIDs)
+		if docFilter is not None and not docFilter: # whoosh 把空的 filter 视为不过滤
+			return []
+		hits = searcher.search(
+				q = query,
+				limit = limit,
+				filter = docFilter,
+				mask = self.local.discard_docnums,
+			)
+		return [(hit["newsID"],hit.rank) for hit in hits]
+
+	def search_hits(self, keyword, fields, depth, newsIDs=[], conj="OR", rangeKey=None):
+		""" 以 conj 连接空格分开的词检索，返回前 depth 条 [(newsID, rank), ...]
+
+			结果按 (关键词, 字段, 检索范围, 连接方式) 缓存，翻页或重复检索时不必访问索引，
+			缓存的条数不够时加倍取
+		"""
+		words = keyword.lower().split()
+		key = (" ".join(words), tuple(fields), rangeKey if rangeKey is not None else frozenset(newsIDs), conj)
+		generation = self.check()
+		cached = self.searchCache.get(key, generation)
+		if cached is not None and (cached[1] or len(cached[0]) >= depth):
+			return cached[0][:depth]
+
+		limit = max(depth, 2*len(cached[0])) if cached is not None else depth
+		hits = self.search_strings((" %s " % conj).join(words), fields, limit, newsIDs, rangeKey)
+		self.searchCache.put(key, generation, (hits, len(hits) < limit)) # 不足 limit 条说明已经取完
+		return hits[:depth]
 
 
 class WxAuth(requests.auth.AuthBase):
@@ -16,11 +16,11 @@ import simplejson as json
 from lxml import etree
 from pypinyin import lazy_pinyin
 
-from ..lib.utilfuncs import dictToESC, get_secret
+from ..lib.utilfuncs import dictToESC, get_secret, get_MD5
 from ..lib.utilclass import Logger, Encipher
 from ..lib.wxapi import jscode2session
 from ..lib.tfidf import TFIDF
-from ..lib.minipgm_api.db import UserDB, NewsDB, ReporterDB
+from ..lib.minipgm_api.db import UserDB, NewsDB, ReporterDB, time_keys, read_keys
 from ..lib.minipgm_api.error import *
 from ..lib.minipgm_api.util import *
 
@@ -207,11 +207,14 @@ def get_col_hot():
 	try:
 		reqData = request.json
 		limit = int_param('limit', reqData.get("limit"), maxi=10)
-		page = int_param('page', reqData.get("page"))
 
 		newsDB = NewsDB()
-		newsInfo = newsDB.get_hot_news()
-		newsInfo = newsInfo[(page-1)*limit: page*limit]
+		if "cursor" in reqData: # 游标翻页
+			after = cursor_param('cursor', reqData.get("cursor"), "hot")
+			newsInfo = newsDB.get_hot_news(limit=limit, after=after)
+		else:
+			page = int_param('page', reqData.get("page"))
+			newsInfo = newsDB.get_hot_news(limit=limit, offset=(page-1)*limit)
 
 		newsCol = userDB.get_newsCol(session["openid"])
 		for news in newsInfo:
@@ -222,6 +225,8 @@ def get_col_hot():
 		raise err
 	else:
 		jsonPack = {"errcode": 0, "news": newsInfo}
+		if "cursor" in reqData:
+			jsonPack["cursor"] = next_cursor("hot", newsInfo, limit, read_keys)
 	finally:
 		newsDB.close()
 		return json.dumps(jsonPack)
@@ -266,13 +271,18 @@ def get_column_news():
 		reqData = request.json
 		column = limited_param("column", reqData.get("column"), columns)
 		limit = int_param('limit', reqData.get("limit"), maxi=10)
-		page = int_param('page', reqData.get("page"), mini=0)
 
 		newsDB = NewsDB()
 
-		newsInfo = newsDB.get_column_news(column)
-		if page > 0:
-			newsInfo = newsInfo[(page-1)*limit: page*limit]
+		if "cursor" in reqData: # 游标翻页
+			after = cursor_param('cursor', reqData.get("cursor"), "column:%s" % column)
+			newsInfo = newsDB.get_column_news(column, limit=limit, after=after)
+		else:
+			page = int_param('page', reqData.get("page"), mini=0)
+			if page > 0:
+				newsInfo = newsDB.get_column_news(column, limit=limit, offset=(page-1)*limit)
+			else: # page = 0 则返回全部
+				newsInfo = newsDB.get_column_news(column)
 
 		newsCol = userDB.get_newsCol(session["openid"])
 		for news in newsInfo:
@@ -283,6 +293,8 @@ def get_column_news():
 		raise err
 	else:
 		jsonPack = {"errcode": 0, "news": newsInfo}
+		if "cursor" in reqData:
+			jsonPack["cursor"] = next_cursor("column:%s" % column, newsInfo, limit, time_keys)
 	finally:
 		newsDB.close()
 		return json.dumps(jsonPack)
@@ -336,23 +348,30 @@ def get_reporter_news():
 		reqData = request.json
 		name = limited_param("name", reqData.get("name"), rptDB.get_names())
 		limit = int_param('limit', reqData.get("limit"), maxi=10)
-		page = int_param('page', reqData.get("page"), mini=0)
 
-		newsInfo = newsDB.get_news_by_ID(rptDB.get_rpt(name)['news'])
+		if "cursor" in reqData: # 游标翻页
+			after = cursor_param('cursor', reqData.get("cursor"), "reporter:%s" % name)
+			newsInfo = newsDB.get_reporter_news(rptDB.get_rpt(name)['news'], limit=limit, after=after)
+		else:
+			page = int_param('page', reqData.get("page"), mini=0)
+			if page > 0:
+				newsInfo = newsDB.get_reporter_news(rptDB.get_rpt(name)['news'], limit=limit, offset=(page-1)*limit)
+			else: # page = 0 则返回全部
+				newsInfo = newsDB.get_reporter_news(rptDB.get_rpt(name)['news'])
 
 		newsCol = userDB.get_newsCol(session["openid"])
 		for news in newsInfo:
 			news.update({
 				"star": news["newsID"] in newsCol,
 			})
-		if page > 0:
-			newsInfo = newsInfo[(page-1)*limit: page*limit]
 
 	except Exception as err:
 		jsonPack = {"errcode": -1, "error": repr(err)}
 		raise err
 	else:
 		jsonPack = {"errcode": 0, "news": newsInfo}
+		if "cursor" in reqData:
+			jsonPack["cursor"] = next_cursor("reporter:%s" % name, newsInfo, limit, time_keys)
 	finally:
 		newsDB.close()
 		return json.dumps(jsonPack)
@@ -366,25 +385,28 @@ def get_favorite():
 	try:
 		reqData = request.json
 		limit = int_param('limit', reqData.get("limit"), maxi=10)
-		page = int_param('page', reqData.get("page"), mini=0) # 允许等于0
 
 		newsDB = NewsDB()
 		newsCol = userDB.get_newsCol(session["openid"],withTime=True)
-		newsInfo = newsDB.get_news_by_ID(list(newsCol.keys()))
+		if "cursor" in reqData: # 游标翻页
+			after = cursor_param('cursor', reqData.get("cursor"), "favorite")
+			newsInfo = newsDB.get_favorite_news(newsCol, limit=limit, after=after)
+		else:
+			page = int_param('page', reqData.get("page"), mini=0) # 允许等于0
+			if page > 0:
+				newsInfo = newsDB.get_favorite_news(newsCol, limit=limit, offset=(page-1)*limit)
+			else: # page = 0 则返回全部
+				newsInfo = newsDB.get_favorite_news(newsCol)
 		for news in newsInfo:
-			news.update({
-				"star": True,
-				"starTime": newsCol[news["newsID"]]
-			})
-		newsInfo.sort(key=lambda news: news["starTime"], reverse=True)
-		if page > 0: # page = 0 则返回全部
-			newsInfo = newsInfo[(page-1)*limit: page*limit]
+			news.update({"star": True})
 
 	except Exception as err:
 		jsonPack = {"errcode": -1, "error": repr(err)}
 		raise err
 	else:
 		jsonPack = {"errcode": 0, "news": newsInfo}
+		if "cursor" in reqData:
+			jsonPack["cursor"] = next_cursor("favorite", newsInfo, limit, lambda news: [news["starTime"], news["newsID"]])
 	finally:
 		newsDB.close()
 		return json.dumps(jsonPack)
@@ -423,24 +445,31 @@ def search_by_keyword():
 		reqData = request.json
 		keyword = str_param('keyword', reqData.get("keyword"))
 		limit = int_param('limit', reqData.get("limit"), maxi=10)
-		page = int_param('page', reqData.get("page"))
 
 		newsRange = reqData.get("range")
+		newsIDs, rangeKey = [], None # 栏目、作者的范围在索引中预先算好
 		if newsRange is None:
 			raise KeyError("param 'range' is missing !")
 		elif newsRange == 'all':
-			newsIDs = []
+			pass
 		elif newsRange == 'favorite':
 			newsIDs = userDB.get_newsCol(session["openid"])
 		elif newsRange in columns:
-			newsIDs = newsDB.get_column_newsIDs(newsRange)
-		elif newsRange in rptDB.get_names():
-			newsIDs = [news["newsID"] for news in rptDB.get_rpt(newsRange)["news"]]
+			rangeKey = ("column", newsRange)
+		elif newsDB.has_search_range(("reporter", newsRange)):
+			rangeKey = ("reporter", newsRange)
 		else:
 			raise KeyError("unexpected value of 'range' -- %s !" % newsRange)
 
-		newsInfo = newsDB.search_by_keyword(keyword, limit=limit*page, newsIDs=newsIDs)
-		newsInfo = newsInfo[(page-1)*limit: page*limit]
+		if "cursor" in reqData: # 游标翻页，游标为已返回的结果数，与检索条件绑定
+			cursorKind = "search:%s" % get_MD5("%s|%s" % (keyword, newsRange))
+			after = cursor_param('cursor', reqData.get("cursor"), cursorKind)
+			offset = after[0] if after is not None else 0
+		else:
+			page = int_param('page', reqData.get("page"))
+			offset = (page-1)*limit
+
+		newsInfo = newsDB.search_by_keyword(keyword, limit=limit, newsIDs=newsIDs, offset=offset, rangeKey=rangeKey)
 
 		newsCol = userDB.get_newsCol(session["openid"])
 		for news in newsInfo:
@@ -451,6 +480,8 @@ def search_by_keyword():
 		raise err
 	else:
 		jsonPack = {"errcode": 0, "news": newsInfo}
+		if "cursor" in reqData:
+			jsonPack["cursor"] = next_cursor(cursorKind, newsInfo, limit, lambda news: [offset + len(newsInfo)])
 	finally:
 		newsDB.close()
 		return json.dumps(jsonPack)
@@ -533,6 +564,38 @@ def recommend():
 		return json.dumps(jsonPack)
 
 
+@miniprogram_api.route("/recommend_by_text", methods=["POST"])
+@verify_timestamp
+@verify_signature
+@verify_login
+def recommend_by_text():
+	try:
+		newsDB = NewsDB()
+
+		reqData = request.json
+		limit = int_param('limit', reqData.get("limit"), maxi=10)
+		text = str_param('text', reqData.get("text"))
+
+		Tcs = tfidf.recommend_by_text(text, limit)
+		newsInfo = newsDB.get_news_by_ID(list(Tcs.keys()))
+
+		newsCol = userDB.get_newsCol(session["openid"])
+		for news in newsInfo:
+			newsID = news["newsID"]
+			news.update({"star": newsID in newsCol, "rank": Tcs[newsID]})
+
+		newsInfo.sort(key=lambda news: news["rank"], reverse=True)
+
+	except Exception as err:
+		jsonPack = {"errcode": -1, "error": repr(err)}
+		raise err
+	else:
+		jsonPack = {"errcode": 0, "news": newsInfo}
+	finally:
+		newsDB.close()
+		return json.dumps(jsonPack)
+
+
 @miniprogram_api.route("/get_update_log", methods=["GET"])
 @verify_timestamp
 @verify_signature
@@ -126,6 +126,7 @@ def change():
 			value = " ".join(value.strip().split())
 
 		db.update("newsDetail", newsID, {key: value})
+		db.bump_generation() # 使接口的结果缓存失效
 	except Exception as err:
 		jsonPack = {"errcode": -1, "error": repr(err)}
 	else: